@@ -17,16 +17,26 @@ done
 
 
 echo "Copying files to '/opt/vmnotification'"
-vmnotification_files=(          \
-  "LICENSE"                     \
-  "Pipfile"                     \
-  "Pipfile.lock"                \
-  "README.md"                   \
-  "utils.py"                    \
-  "vmnotification.py"           \
-  "vmnotification_config.py"    \
-  "vmnotification_exception.py" \
-  "vmnotification_service.py"   \
+vmnotification_files=(             \
+  "LICENSE"                        \
+  "Pipfile"                        \
+  "Pipfile.lock"                   \
+  "README.md"                      \
+  "utils.py"                       \
+  "vmnotification.py"              \
+  "vmnotification_config.py"       \
+  "vmnotification_control.py"      \
+  "vmnotification_coordination.py" \
+  "vmnotification_exception.py"    \
+  "vmnotification_handoff.py"      \
+  "vmnotification_hook_policy.py"  \
+  "vmnotification_protocol.py"     \
+  "vmnotification_replay.py"       \
+  "vmnotification_service.py"      \
+  "vmnotification_systemd.py"      \
+  "vmnotification_tracing.py"      \
+  "vmnotification_transcript.py"   \
+  "vmnotification_warmup.py"       \
 )
 for item in ${vmnotification_files[@]}; do
   echo " Copying file '$item'"
@@ -36,6 +46,9 @@ done
 echo "Setting file execute permission on '/opt/vmnotification/vmnotification.py'"
 chmod a+x /opt/vmnotification/vmnotification.py
 
+echo "Precompiling '/opt/vmnotification' to bytecode"
+python3 -m compileall -q /opt/vmnotification
+
 echo "Copying 'vmnotification' file to '/etc/default/'"
 cp ./vmnotification /etc/default/
 
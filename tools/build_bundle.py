@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Build a single-file zipapp of the service with its modules precompiled to bytecode, so that nothing is compiled
+on startup, e.g.:
+
+    python3 tools/build_bundle.py --output /opt/vmnotification/vmnotification.pyz
+    python3 /opt/vmnotification/vmnotification.pyz --config /etc/vmnotification/vmnotification.conf
+
+The bytecode is specific to the Python version used to build the bundle, which must match the one running it.
+"""
+import argparse
+import py_compile
+import shutil
+import sys
+import tempfile
+import zipapp
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# The service modules, all at the top of the repository
+MODULES = sorted(p.name for p in ROOT.glob("*.py"))
+
+MAIN = "import vmnotification\nvmnotification.main()\n"
+
+
+def build(output: Path, interpreter: str):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "__main__.py").write_text(MAIN, encoding="utf-8")
+        for module in MODULES + ["__main__.py"]:
+            source = tmp / module
+            if module != "__main__.py":
+                shutil.copy(ROOT / module, source)
+            # zipimport loads a .pyc stored next to where the source would be, so only the bytecode is bundled
+            py_compile.compile(str(source), cfile=str(source.with_suffix(".pyc")), doraise=True,
+                               invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+            if module != "__main__.py":
+                source.unlink()
+        output.parent.mkdir(parents=True, exist_ok=True)
+        zipapp.create_archive(tmp, target=output, interpreter=interpreter)
+    print(f"Bundle written to '{output}' ({output.stat().st_size} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a precompiled zipapp of the vMotion notification service")
+    parser.add_argument('-o', '--output', type=Path, default=ROOT / "dist" / "vmnotification.pyz")
+    parser.add_argument('--interpreter', type=str, default="/usr/bin/env python3")
+    args = parser.parse_args()
+    build(output=args.output, interpreter=args.interpreter)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Fuzz the decoding of the 'check-for-event' replies, which must never stop the service: a reply is either decoded
+into an event the service can handle, or rejected with VMNotificationProtocolException (VMNotificationException
+for a reply reporting an error).
+
+Edge cases (NaN, Infinity, huge or negative times and timeouts, wrong types, truncated JSON) are checked first,
+then random mutations of valid replies:
+
+    python3 tools/protocol_fuzz.py --iterations 100000 --seed 1
+
+Decoded start events are handled as the service does (timestamp formatting, deadline, trace start time), so an
+out of range value that would only fail there is reported as well.
+"""
+import argparse
+import datetime
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vmnotification_exception import VMNotificationException  # noqa: E402
+from vmnotification_protocol import (EndEvent, StartEvent, TimeoutChangeEvent, UnknownEvent,  # noqa: E402
+                                     decode_event, decode_reply)
+
+VALID_REPLIES = [
+    {"result": True},
+    {"result": True, "eventType": "start", "operationId": 1, "notificationTimeoutInSec": 60,
+     "eventGenTimeInSec": 1700000000},
+    {"result": True, "eventType": "timeout-change", "operationId": 1, "newNotificationTimeoutInSec": 120},
+    {"result": True, "eventType": "end", "operationId": 1},
+]
+
+EDGE_VALUES = [None, True, False, 0, -1, 1, 0.5, -0.0, 1e20, -1e20, 10 ** 30, float("nan"), float("inf"),
+               float("-inf"), 2 ** 31, 2 ** 63, "", "60", [], {}, [60], {"value": 60}]
+
+EDGE_TEXTS = [b"", b" ", b"null", b"[]", b"42", b'"start"', b"{", b'{"result": true', b"\xff\xfe",
+              b'{"result": true, "eventType": "start", "eventGenTimeInSec": NaN}',
+              b'{"result": true, "eventType": "start", "operationId": 1, "notificationTimeoutInSec": Infinity, '
+              b'"eventGenTimeInSec": 1700000000}',
+              b'{"result": true, "eventType": "start", "operationId": 1, "notificationTimeoutInSec": 60, '
+              b'"eventGenTimeInSec": 1' + b"0" * 400 + b"}"]
+
+
+def handle(event):
+    """ What the service does with a decoded event, before running any command. """
+    match event:
+        case StartEvent():
+            datetime.datetime.fromtimestamp(event.event_time)
+            int(event.event_time * 1e9)
+            _ = time.time() >= event.deadline
+            assert event.notification_timeout > 0, f"notification timeout {event.notification_timeout!r}"
+        case TimeoutChangeEvent():
+            assert event.new_notification_timeout > 0, f"notification timeout {event.new_notification_timeout!r}"
+        case EndEvent() | UnknownEvent() | None:
+            pass
+        case _:
+            raise AssertionError(f"unexpected event {event!r}")
+
+
+def check(data: bytes) -> str:
+    """ Decode a reply, and return a description of the failure, or an empty string. """
+    try:
+        handle(decode_event(decode_reply(data)))
+    except VMNotificationException:
+        pass
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return ""
+
+
+def edge_cases():
+    yield from EDGE_TEXTS
+    for reply in VALID_REPLIES:
+        yield json.dumps(reply).encode("utf-8")
+        for field in reply:
+            for value in EDGE_VALUES:
+                yield json.dumps(dict(reply, **{field: value})).encode("utf-8")
+            yield json.dumps({k: v for k, v in reply.items() if k != field}).encode("utf-8")
+
+
+def mutations(rng: random.Random, iterations: int):
+    fields = sorted({field for reply in VALID_REPLIES for field in reply})
+    for _ in range(iterations):
+        reply = dict(rng.choice(VALID_REPLIES))
+        for _ in range(rng.randint(1, 3)):
+            match rng.randrange(4):
+                case 0:
+                    reply[rng.choice(fields)] = rng.choice(EDGE_VALUES)
+                case 1:
+                    reply[rng.choice(fields)] = rng.uniform(-1e22, 1e22)
+                case 2:
+                    reply.pop(rng.choice(fields), None)
+                case 3:
+                    reply["eventType"] = rng.choice(["start", "timeout-change", "end", "START", "resume", None, 1])
+        data = json.dumps(reply).encode("utf-8")
+        # Truncated or corrupted replies
+        if rng.random() < 0.1:
+            data = data[:rng.randrange(len(data) + 1)]
+        elif rng.random() < 0.1:
+            i = rng.randrange(len(data))
+            data = data[:i] + bytes([rng.randrange(256)]) + data[i + 1:]
+        yield data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuzz the decoding of the check-for-event replies")
+    parser.add_argument('--iterations', type=int, default=20000, help="Random mutations after the edge cases")
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    seed = args.seed if args.seed is not None else random.randrange(2 ** 32)
+    failures = 0
+    total = 0
+    for source, replies in (("edge case", edge_cases()), ("mutation", mutations(random.Random(seed), args.iterations))):
+        for data in replies:
+            total += 1
+            failure = check(data)
+            if failure:
+                failures += 1
+                print(f"{source}: {data[:200]!r}: {failure}")
+
+    print(f"{total} replies, {failures} failure(s) (seed {seed})")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
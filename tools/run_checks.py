@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Check the service without a host: every recorded transcript of tools/regression is replayed and compared to its
+expected timeline, and the decoding of the host replies is fuzzed.
+
+    python3 tools/run_checks.py
+    python3 tools/run_checks.py --fuzz-iterations 100000
+
+The transcript '<name>.transcript.jsonl' is compared to '<name>.timeline.json'. To add a regression test, record
+a session with the [Transcript] section enabled (e.g. with tools/vmtoolsd_simulator.py), and save its timeline
+once checked:
+
+    ./vmnotification.py replay <name>.transcript.jsonl --write-timeline <name>.timeline.json
+"""
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+REGRESSION_DIR = ROOT / "tools" / "regression"
+TRANSCRIPT_SUFFIX = ".transcript.jsonl"
+
+
+def checks(fuzz_iterations: int, fuzz_seed: int) -> list:
+    """ Return the (name, command) of the checks to run. """
+    result = []
+    for transcript in sorted(REGRESSION_DIR.glob(f"*{TRANSCRIPT_SUFFIX}")):
+        timeline = transcript.with_name(transcript.name.removesuffix(TRANSCRIPT_SUFFIX) + ".timeline.json")
+        result.append((f"replay {transcript.name}",
+                       [sys.executable, str(ROOT / "vmnotification.py"), "replay", str(transcript),
+                        "--expect", str(timeline)]))
+    result.append((f"protocol fuzz ({fuzz_iterations} iterations)",
+                   [sys.executable, str(ROOT / "tools" / "protocol_fuzz.py"),
+                    "--iterations", str(fuzz_iterations), "--seed", str(fuzz_seed)]))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the regression transcripts and fuzz the protocol codec")
+    parser.add_argument('--fuzz-iterations', type=int, default=20000)
+    parser.add_argument('--fuzz-seed', type=int, default=1)
+    args = parser.parse_args()
+
+    failed = []
+    for name, command in checks(args.fuzz_iterations, args.fuzz_seed):
+        output = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        if output.returncode == 0:
+            print(f"ok      {name}")
+        else:
+            failed.append(name)
+            print(f"FAILED  {name}")
+            print(output.stdout.rstrip())
+
+    print(f"{len(failed)} check(s) failed" if failed else "All checks passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
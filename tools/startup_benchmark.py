@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Measure the time from process start to the registration RPC, which is the time during which vMotions are
+invisible to the guest after a boot or a restart.
+
+vmtoolsd is replaced by a shell script that timestamps the registration and replies like the host, e.g.:
+
+    python3 tools/startup_benchmark.py --runs 20
+    python3 tools/startup_benchmark.py --runs 20 --bundle dist/vmnotification.pyz
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+FAKE_VMTOOLSD = """#!/bin/sh
+case "$2" in
+  *.unregister*) echo '{"result": true}' ;;
+  *.register*) date +%s%N >> "$BENCHMARK_MARKER"; echo '{"result": true, "uniqueToken": "benchmark"}' ;;
+  *) echo '{"result": true}' ;;
+esac
+"""
+
+CONFIG = """[DEFAULT]
+app_name = benchmark
+check_interval_seconds = 1
+pre_vmotion_cmd = true
+post_vmotion_cmd = true
+
+[Token]
+token_file = {tmp}/token_file
+
+[Logging]
+service_logfile = {tmp}/vmnotification.log
+vmotion_logfile = {tmp}/vmotion.log
+timeout_logfile = {tmp}/timeout.log
+"""
+
+
+def run_once(command: list, env: dict, marker: Path, timeout_seconds: float) -> float:
+    marker.unlink(missing_ok=True)
+    start_ns = time.time_ns()
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + timeout_seconds
+        while not marker.exists() or not marker.read_text().strip():
+            if time.monotonic() > deadline or process.poll() is not None:
+                raise RuntimeError(f"The service did not register within {timeout_seconds} seconds")
+            time.sleep(0.001)
+        return (int(marker.read_text().split()[0]) - start_ns) / 1e6
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the vMotion notification service startup time")
+    parser.add_argument('-n', '--runs', type=int, default=10)
+    parser.add_argument('--bundle', type=str, default=None, help="Benchmark a zipapp bundle instead of the sources")
+    parser.add_argument('--no-snapshot', action='store_true', help="Disable the configuration snapshot")
+    parser.add_argument('--timeout', type=float, default=10.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        vmtoolsd = tmp / "bin" / "vmtoolsd"
+        vmtoolsd.parent.mkdir()
+        vmtoolsd.write_text(FAKE_VMTOOLSD, encoding="utf-8")
+        vmtoolsd.chmod(0o755)
+        config_file = tmp / "vmnotification.conf"
+        config_file.write_text(CONFIG.format(tmp=tmp), encoding="utf-8")
+        marker = tmp / "registered"
+
+        env = dict(os.environ)
+        env["PATH"] = f"{vmtoolsd.parent}{os.pathsep}{env.get('PATH', '')}"
+        env["BENCHMARK_MARKER"] = str(marker)
+        env.pop("NOTIFY_SOCKET", None)
+
+        program = args.bundle if args.bundle else str(ROOT / "vmnotification.py")
+        snapshot = "" if args.no_snapshot else str(tmp / "config_snapshot.json")
+        command = [sys.executable, program, "--config", str(config_file), "--config-snapshot", snapshot]
+
+        samples = [run_once(command, env, marker, args.timeout) for _ in range(args.runs)]
+
+    print(f"{program}: {args.runs} runs, process start to registration (ms)")
+    print(f"  min: {min(samples):.1f}  median: {statistics.median(samples):.1f}  max: {max(samples):.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
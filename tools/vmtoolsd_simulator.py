@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Stand-in for 'vmtoolsd --cmd' that simulates the vm-operation-notification RPCs of the host, to run the service
+without a vMotion. The replies are encoded with the same protocol codec as the service decodes them.
+
+Install it as 'vmtoolsd' in front of the PATH, and describe the events to send in a scenario file:
+
+    mkdir -p /tmp/simulator && ln -sf $PWD/tools/vmtoolsd_simulator.py /tmp/simulator/vmtoolsd
+    export PATH=/tmp/simulator:$PATH VMTOOLSD_SIMULATOR_SCENARIO=scenario.json
+    ./vmnotification.py --config vmnotification.conf
+
+The scenario lists the events returned by 'check-for-event', by poll number (starting at 1). Start events are
+generated 'age' seconds before they are returned. Any other field is sent as is, e.g. to send invalid replies:
+
+    {"events": [
+        {"poll": 3, "eventType": "start", "operationId": 1, "notificationTimeoutInSec": 60, "age": 0},
+        {"poll": 5, "eventType": "timeout-change", "operationId": 1, "newNotificationTimeoutInSec": 120},
+        {"poll": 8, "eventType": "end", "operationId": 1}
+    ]}
+
+The simulator state (registrations, polls and acks) is kept in VMTOOLSD_SIMULATOR_STATE.
+"""
+import json
+import os
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from vmnotification_protocol import encode_reply  # noqa: E402
+
+STATE_FILE = os.environ.get("VMTOOLSD_SIMULATOR_STATE", "/tmp/vmtoolsd_simulator_state.json")
+SCENARIO_FILE = os.environ.get("VMTOOLSD_SIMULATOR_SCENARIO")
+MAX_REGISTRATIONS = 1
+
+
+def load_state() -> dict:
+    try:
+        with open(STATE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"registrations": {}, "polls": 0, "acks": []}
+
+
+def save_state(state: dict):
+    with open(STATE_FILE, mode='w', encoding="utf-8") as f:
+        json.dump(state, f)
+
+
+def load_events() -> dict:
+    if not SCENARIO_FILE:
+        return {}
+    with open(SCENARIO_FILE, encoding="utf-8") as f:
+        return {e.pop("poll"): e for e in json.load(f).get("events", [])}
+
+
+def invalid_token() -> str:
+    return encode_reply(error_message="Invalid input: Could not find application with the token., "
+                                      "please see schema for detail and examples")
+
+
+def handle(rpc_name: str, params: dict, state: dict) -> str:
+    registrations = state["registrations"]
+    token = params.get("uniqueToken")
+
+    match rpc_name:
+        case "vm-operation-notification.register":
+            if len(registrations) >= MAX_REGISTRATIONS:
+                return encode_reply(error_message=f"Invalid input: Failed to register additional apps. Max allowed "
+                                                  f"limit of {MAX_REGISTRATIONS} concurrent apps already registered., "
+                                                  f"please see schema for detail and examples")
+            token = str(uuid.uuid4())
+            registrations[token] = params.get("appName")
+            return encode_reply(uniqueToken=token)
+
+        case "vm-operation-notification.unregister":
+            if registrations.pop(token, None) is None:
+                return invalid_token()
+            return encode_reply()
+
+        case "vm-operation-notification.check-for-event":
+            if token not in registrations:
+                return invalid_token()
+            state["polls"] += 1
+            event = load_events().get(state["polls"])
+            if event is None:
+                return encode_reply()
+            if event.get("eventType") == "start" and "eventGenTimeInSec" not in event:
+                event["eventGenTimeInSec"] = int(time.time() - event.pop("age", 0))
+            return encode_reply(**event)
+
+        case "vm-operation-notification.ack-event":
+            if token not in registrations:
+                return invalid_token()
+            state["acks"].append({"operationId": params.get("operationId"), "time": time.time()})
+            return encode_reply()
+
+        case "vm-operation-notification.list":
+            return encode_reply(info=[{"appName": name} for name in registrations.values()])
+
+        case _:
+            return encode_reply(error_message=f"Unknown command '{rpc_name}'")
+
+
+def main():
+    if len(sys.argv) != 3 or sys.argv[1] != "--cmd":
+        print("Usage: vmtoolsd --cmd '<rpc> <json params>'")
+        return 1
+
+    rpc_name, _, param = sys.argv[2].partition(" ")
+    params = json.loads(param) if param.strip() else {}
+    state = load_state()
+    print(handle(rpc_name, params, state))
+    save_state(state)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
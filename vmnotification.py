@@ -1,12 +1,32 @@
 #! /usr/bin/env python3
-import argparse
 import logging
-import logging.handlers
+import sys
 
 from pathlib import Path
 
 from utils import create_folders, get_logging_level
-from vmnotification_config import VMNotificationConfig
+from vmnotification_config import DEFAULT_CONFIG_SNAPSHOT_FILE, VMNotificationConfig
+
+
+class StartupLogBuffer(logging.Handler):
+    """
+    Hold the log records emitted while registering, before the log files are set up, and replay them once the
+    loggers are created.
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records = []
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(record)
+
+    def replay(self):
+        for record in self.records:
+            record_logger = logging.getLogger(record.name)
+            if record_logger.isEnabledFor(record.levelno):
+                record_logger.handle(record)
+        self.records = []
 
 
 def create_logger(logger_name: str,
@@ -15,6 +35,7 @@ def create_logger(logger_name: str,
                   console_level: int,
                   logfile_maxsize_bytes: int,
                   logfile_count: int) -> logging.Logger:
+    import logging.handlers
 
     logger = logging.getLogger(logger_name)
 
@@ -42,58 +63,78 @@ def create_logger(logger_name: str,
     return logger
 
 
-def main():
+def create_parser():
+    import argparse
 
-    # Get CLI input
     parser = argparse.ArgumentParser(prog='vmnotification', description='vMotion Notification for Linux')
     parser.add_argument('-c', '--config', type=str, required=True)
-    args = parser.parse_args()
-    config_file = args.config
+    parser.add_argument('--config-snapshot', type=str, default=DEFAULT_CONFIG_SNAPSHOT_FILE,
+                        help="Validated configuration cache used to speed up startup ('' to disable)")
+    return parser
+
+
+def parse_args(argv: list) -> tuple:
+    """
+    Return the configuration file and snapshot file. The arguments used by the systemd unit are handled without
+    importing argparse, which is only used for anything else (help, errors, abbreviations).
+    """
+    options = {"config": None, "config_snapshot": DEFAULT_CONFIG_SNAPSHOT_FILE}
+    args = iter(argv)
+    try:
+        for arg in args:
+            name, sep, value = arg.partition("=")
+            match name:
+                case "-c" | "--config":
+                    key = "config"
+                case "--config-snapshot":
+                    key = "config_snapshot"
+                case _:
+                    raise ValueError(arg)
+            options[key] = value if sep else next(args)
+        if options["config"]:
+            return options["config"], options["config_snapshot"]
+    except (ValueError, StopIteration):
+        pass
+
+    args = create_parser().parse_args(argv)
+    return args.config, args.config_snapshot
+
+
+def main():
+
+    # Client of the control socket of the running service
+    if sys.argv[1:2] == ["ctl"]:
+        from vmnotification_control import main as ctl_main
+
+        exit(ctl_main(sys.argv[2:]))
+
+    # Replay of a recorded RPC transcript
+    if sys.argv[1:2] == ["replay"]:
+        from vmnotification_replay import main as replay_main
+
+        exit(replay_main(sys.argv[2:]))
+
+    # Get CLI input
+    config_file, snapshot_file = parse_args(sys.argv[1:])
 
     # Check if a configuration file exists
     if not (Path(config_file).is_file() and Path(config_file).exists()):
         print(f"Configuration file is missing: '{config_file}'")
-        parser.print_help()
+        create_parser().print_help()
         exit(1)
 
-    # Parse configuration file
-    config = VMNotificationConfig(config_file=config_file)
-    config.print()
-
-    # Create required folders
-    create_folders(config.service_logfile)
-    create_folders(config.vmotion_logfile)
-    create_folders(config.timeout_logfile)
-    create_folders(config.token_file)
-
-    # Create logger
-    logger = create_logger(logger_name='',
-                           logfile=config.service_logfile,
-                           log_level=get_logging_level(config.service_logfile_level),
-                           console_level=get_logging_level(config.service_console_level),
-                           logfile_maxsize_bytes=config.service_logfile_maxsize_bytes,
-                           logfile_count=config.service_logfile_count)
-
-    logger_vmotion = create_logger(logger_name='vmotion',
-                                   logfile=config.vmotion_logfile,
-                                   log_level=get_logging_level("DEBUG"),
-                                   console_level=get_logging_level("DEBUG"),
-                                   logfile_maxsize_bytes=config.vmotion_logfile_maxsize_bytes,
-                                   logfile_count=config.vmotion_logfile_count)
-
-    logger_timeout = create_logger(logger_name='timeout',
-                                   logfile=config.timeout_logfile,
-                                   log_level=get_logging_level("DEBUG"),
-                                   console_level=get_logging_level("DEBUG"),
-                                   logfile_maxsize_bytes=config.timeout_logfile_maxsize_bytes,
-                                   logfile_count=config.timeout_logfile_count)
+    # Keep the log records until the log files are set up, after the registration
+    startup_log = StartupLogBuffer()
+    root_logger = logging.getLogger('')
+    root_logger.setLevel(logging.DEBUG)
+    root_logger.addHandler(startup_log)
+
+    # Load the configuration from its snapshot, or parse the configuration file
+    config = VMNotificationConfig.load(config_file=config_file, snapshot_file=snapshot_file)
 
     from vmnotification_service import VMNotificationService
 
-    logger.debug("Starting vMotion notification service")
-    logger.debug(f"Config: {config.json()}")
-    logger.debug(f"Application pre migration command: '{config.pre_vmotion_cmd}'")
-    logger.debug(f"Application post migration command: '{config.post_vmotion_cmd}'")
+    # Only what registering needs, the optional features are attached once registered
     vmn = VMNotificationService(pre_vmotion_cmd=config.pre_vmotion_cmd,
                                 post_vmotion_cmd=config.post_vmotion_cmd,
                                 token_file=config.token_file,
@@ -101,8 +142,151 @@ def main():
                                 check_interval_seconds=config.check_interval_seconds,
                                 token_file_create=config.token_file_create,
                                 token_obfuscate_logfile=config.token_obfuscate_logfile)
-    vmn.run()
 
+    control = None
+
+    def attach_features(logger: logging.Logger):
+        """ Create the optional features from the configuration, and attach them to the service. """
+        nonlocal control
+        from vmnotification_hook_policy import HookPolicy, restore_throttled_cgroups
+        from vmnotification_tracing import create_tracer
+
+        vmn.tracer = create_tracer(exporter=config.tracing_exporter,
+                                   otlp_endpoint=config.tracing_otlp_endpoint,
+                                   otlp_timeout_seconds=config.tracing_otlp_timeout_seconds,
+                                   trace_file=config.tracing_file,
+                                   resource_attributes={"vmnotification.app_name": config.app_name})
+
+        vmn.pre_vmotion_policy = HookPolicy.from_config("pre_vmotion", config.pre_vmotion_hook_policy)
+        vmn.post_vmotion_policy = HookPolicy.from_config("post_vmotion", config.post_vmotion_hook_policy)
+
+        # CPU limits left throttled by a previous process that died during a hook
+        restore_throttled_cgroups()
+
+        if config.coordination_enabled:
+            import socket
+
+            from vmnotification_coordination import create_coordinator
+
+            vmn.coordinator = create_coordinator(backend=config.coordination_backend,
+                                                 group=config.coordination_group,
+                                                 member_id=config.coordination_member_id or socket.gethostname(),
+                                                 max_concurrent_drains=config.coordination_max_concurrent_drains,
+                                                 lease_ttl_seconds=config.coordination_lease_ttl_seconds,
+                                                 retry_interval_seconds=config.coordination_retry_interval_seconds,
+                                                 budget_margin_seconds=config.coordination_budget_margin_seconds,
+                                                 max_migration_seconds=config.coordination_max_migration_seconds,
+                                                 lease_file=config.coordination_lease_file,
+                                                 sqlite_database=config.coordination_sqlite_database,
+                                                 consul_url=config.coordination_consul_url,
+                                                 consul_key_prefix=config.coordination_consul_key_prefix,
+                                                 consul_token=config.coordination_consul_token)
+            logger.debug(f"Drain coordination: at most {config.coordination_max_concurrent_drains} member(s) of "
+                         f"'{config.coordination_group}' drain at the same time ({config.coordination_backend} backend)")
+
+        if config.warmup_enabled:
+            from vmnotification_warmup import Warmup
+
+            vmn.warmup = Warmup(tasks=config.warmup_tasks,
+                                max_workers=config.warmup_max_workers,
+                                deadline_seconds=config.warmup_deadline_seconds,
+                                probe_cmd=config.warmup_probe_cmd or None,
+                                target_latency_ms=config.warmup_target_latency_ms,
+                                probe_interval_seconds=config.warmup_probe_interval_seconds,
+                                ready_cmd=config.warmup_ready_cmd or None,
+                                curve_file=config.warmup_curve_file or None)
+            logger.debug(f"Warm-up after migration: {len(config.warmup_tasks)} task(s) on "
+                         f"{config.warmup_max_workers} worker(s), deadline {config.warmup_deadline_seconds} seconds")
+
+        if config.transcript_enabled:
+            from vmnotification_transcript import TranscriptRecorder
+
+            transcript = TranscriptRecorder(transcript_file=config.transcript_file)
+            try:
+                transcript.open(app_name=config.app_name,
+                                check_interval_seconds=config.check_interval_seconds,
+                                pre_vmotion_cmd=config.pre_vmotion_cmd,
+                                post_vmotion_cmd=config.post_vmotion_cmd)
+                vmn.transcript = transcript
+            except OSError as e:
+                logger.error(f"Could not open the transcript file '{config.transcript_file}': {e}")
+
+        if config.control_enabled:
+            from vmnotification_control import ControlServer
+
+            create_folders(config.control_socket)
+            control = ControlServer(service=vmn,
+                                    socket_path=config.control_socket,
+                                    list_ttl_seconds=config.control_list_ttl_seconds)
+            try:
+                control.start()
+            except OSError as e:
+                control = None
+                logger.error(f"Could not open the control socket '{config.control_socket}': {e}")
+
+    def finish_startup(registered: bool = True):
+        """ Everything not needed to register, run once the service is registered. """
+        if startup_log not in root_logger.handlers:
+            return
+
+        config.print()
+
+        # Create required folders
+        create_folders(config.service_logfile)
+        create_folders(config.vmotion_logfile)
+        create_folders(config.timeout_logfile)
+        create_folders(config.token_file)
+        if config.tracing_exporter == "file":
+            create_folders(config.tracing_file)
+        if config.warmup_enabled and config.warmup_curve_file:
+            create_folders(config.warmup_curve_file)
+
+        # Create logger
+        root_logger.removeHandler(startup_log)
+        logger = create_logger(logger_name='',
+                               logfile=config.service_logfile,
+                               log_level=get_logging_level(config.service_logfile_level),
+                               console_level=get_logging_level(config.service_console_level),
+                               logfile_maxsize_bytes=config.service_logfile_maxsize_bytes,
+                               logfile_count=config.service_logfile_count)
+
+        create_logger(logger_name='vmotion',
+                      logfile=config.vmotion_logfile,
+                      log_level=get_logging_level("DEBUG"),
+                      console_level=get_logging_level("DEBUG"),
+                      logfile_maxsize_bytes=config.vmotion_logfile_maxsize_bytes,
+                      logfile_count=config.vmotion_logfile_count)
+
+        create_logger(logger_name='timeout',
+                      logfile=config.timeout_logfile,
+                      log_level=get_logging_level("DEBUG"),
+                      console_level=get_logging_level("DEBUG"),
+                      logfile_maxsize_bytes=config.timeout_logfile_maxsize_bytes,
+                      logfile_count=config.timeout_logfile_count)
+
+        logger.debug("Starting vMotion notification service")
+        startup_log.replay()
+        logger.debug(f"Config: {config.json()}")
+        logger.debug(f"Application pre migration command: '{config.pre_vmotion_cmd}'")
+        logger.debug(f"Application post migration command: '{config.post_vmotion_cmd}'")
+
+        # Cache the validated configuration for the next start
+        if snapshot_file and config.config is not None:
+            config.save_snapshot(snapshot_file)
+
+        if registered:
+            attach_features(logger)
+
+    vmn.run(on_registered=finish_startup)
+
+    # Registration failed, the logs still need to be written
+    finish_startup(registered=False)
+
+    if control is not None:
+        control.close()
+    if vmn.transcript is not None:
+        vmn.transcript.close()
+    vmn.tracer.flush()
 
 if __name__ == "__main__":
     main()
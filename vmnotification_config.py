@@ -1,4 +1,7 @@
-import configparser
+import json
+import os
+from pathlib import Path
+from typing import Optional
 
 DEFAULT_APP_NAME = "my_app"
 DEFAULT_CHECK_INTERVAL_SECONDS = 1
@@ -16,11 +19,49 @@ DEFAULT_VMOTION_LOGFILE_COUNT = 3
 DEFAULT_TIMEOUT_LOGFILE = "/var/log/vmnotification/timeout.log"
 DEFAULT_TIMEOUT_LOGFILE_MAXSIZE_BYTES = 20 * 1024 * 1024
 DEFAULT_TIMEOUT_LOGFILE_COUNT = 3
+DEFAULT_TRACING_EXPORTER = "none"
+DEFAULT_TRACING_OTLP_ENDPOINT = "http://localhost:4318/v1/traces"
+DEFAULT_TRACING_OTLP_TIMEOUT_SECONDS = 2.0
+DEFAULT_TRACING_FILE = "/var/log/vmnotification/traces.jsonl"
+TRACING_EXPORTERS = ("none", "otlp", "file")
+DEFAULT_COORDINATION_ENABLED = False
+DEFAULT_COORDINATION_BACKEND = "file"
+# Empty for the hostname, resolved when the coordinator is created so that a cloned or renamed VM does not reuse it
+DEFAULT_COORDINATION_MEMBER_ID = ""
+DEFAULT_COORDINATION_MAX_CONCURRENT_DRAINS = 1
+DEFAULT_COORDINATION_LEASE_TTL_SECONDS = 900
+DEFAULT_COORDINATION_RETRY_INTERVAL_SECONDS = 1.0
+DEFAULT_COORDINATION_BUDGET_MARGIN_SECONDS = 5.0
+DEFAULT_COORDINATION_MAX_MIGRATION_SECONDS = 3600
+DEFAULT_COORDINATION_LEASE_FILE = "/var/lib/vmnotification/leases.json"
+DEFAULT_COORDINATION_SQLITE_DATABASE = "/var/lib/vmnotification/leases.db"
+DEFAULT_COORDINATION_CONSUL_URL = "http://127.0.0.1:8500"
+DEFAULT_COORDINATION_CONSUL_KEY_PREFIX = "vmnotification/leases"
+DEFAULT_COORDINATION_CONSUL_TOKEN = ""
+COORDINATION_BACKENDS = ("file", "sqlite", "consul")
+DEFAULT_WARMUP_ENABLED = False
+DEFAULT_WARMUP_MAX_WORKERS = 4
+DEFAULT_WARMUP_DEADLINE_SECONDS = 300.0
+DEFAULT_WARMUP_PROBE_CMD = ""
+DEFAULT_WARMUP_PROBE_INTERVAL_SECONDS = 1.0
+DEFAULT_WARMUP_READY_CMD = ""
+DEFAULT_WARMUP_CURVE_FILE = "/var/log/vmnotification/warmup.jsonl"
+WARMUP_TASK_SECTION_PREFIX = "Warmup:"
+DEFAULT_CONTROL_ENABLED = True
+DEFAULT_CONTROL_SOCKET = "/var/run/vmnotification/control.sock"
+DEFAULT_CONTROL_LIST_TTL_SECONDS = 30.0
+DEFAULT_TRANSCRIPT_ENABLED = False
+DEFAULT_TRANSCRIPT_FILE = "/var/log/vmnotification/transcript.jsonl"
+DEFAULT_CONFIG_SNAPSHOT_FILE = "/var/cache/vmnotification/config_snapshot.json"
+# Modules whose changes invalidate the snapshot, e.g. new defaults or validation rules after an upgrade
+CONFIG_SNAPSHOT_MODULES = ("vmnotification_config.py", "vmnotification_hook_policy.py", "vmnotification_warmup.py")
 
 
 class VMNotificationConfig(object):
 
     def __init__(self, config_file: str):
+        import configparser
+
         self.config_file = config_file
         self.config = configparser.ConfigParser()
         self.config.read(self.config_file)
@@ -104,7 +145,261 @@ class VMNotificationConfig(object):
                                                         option="timeout_logfile_count",
                                                         fallback=DEFAULT_TIMEOUT_LOGFILE_COUNT)
 
-    def json(self):
+        #
+        # Tracing Section
+        #
+        self.tracing_exporter = self.config.get(section="Tracing",
+                                                option="exporter",
+                                                fallback=DEFAULT_TRACING_EXPORTER)
+
+        self.tracing_otlp_endpoint = self.config.get(section="Tracing",
+                                                     option="otlp_endpoint",
+                                                     fallback=DEFAULT_TRACING_OTLP_ENDPOINT)
+
+        self.tracing_otlp_timeout_seconds = self.config.getfloat(section="Tracing",
+                                                                 option="otlp_timeout_seconds",
+                                                                 fallback=DEFAULT_TRACING_OTLP_TIMEOUT_SECONDS)
+
+        self.tracing_file = self.config.get(section="Tracing",
+                                            option="trace_file",
+                                            fallback=DEFAULT_TRACING_FILE)
+
+        #
+        # Coordination Section
+        #
+        self.coordination_enabled = self.config.getboolean(section="Coordination",
+                                                           option="enabled",
+                                                           fallback=DEFAULT_COORDINATION_ENABLED)
+
+        self.coordination_backend = self.config.get(section="Coordination",
+                                                    option="backend",
+                                                    fallback=DEFAULT_COORDINATION_BACKEND)
+
+        self.coordination_group = self.config.get(section="Coordination",
+                                                  option="group",
+                                                  fallback=self.app_name)
+
+        self.coordination_member_id = self.config.get(section="Coordination",
+                                                      option="member_id",
+                                                      fallback=DEFAULT_COORDINATION_MEMBER_ID)
+
+        self.coordination_max_concurrent_drains = self.config.getint(section="Coordination",
+                                                                     option="max_concurrent_drains",
+                                                                     fallback=DEFAULT_COORDINATION_MAX_CONCURRENT_DRAINS)
+
+        self.coordination_lease_ttl_seconds = self.config.getint(section="Coordination",
+                                                                 option="lease_ttl_seconds",
+                                                                 fallback=DEFAULT_COORDINATION_LEASE_TTL_SECONDS)
+
+        self.coordination_retry_interval_seconds = self.config.getfloat(section="Coordination",
+                                                                        option="retry_interval_seconds",
+                                                                        fallback=DEFAULT_COORDINATION_RETRY_INTERVAL_SECONDS)
+
+        self.coordination_budget_margin_seconds = self.config.getfloat(section="Coordination",
+                                                                       option="budget_margin_seconds",
+                                                                       fallback=DEFAULT_COORDINATION_BUDGET_MARGIN_SECONDS)
+
+        self.coordination_max_migration_seconds = self.config.getint(section="Coordination",
+                                                                     option="max_migration_seconds",
+                                                                     fallback=DEFAULT_COORDINATION_MAX_MIGRATION_SECONDS)
+
+        self.coordination_lease_file = self.config.get(section="Coordination",
+                                                       option="lease_file",
+                                                       fallback=DEFAULT_COORDINATION_LEASE_FILE)
+
+        self.coordination_sqlite_database = self.config.get(section="Coordination",
+                                                            option="sqlite_database",
+                                                            fallback=DEFAULT_COORDINATION_SQLITE_DATABASE)
+
+        self.coordination_consul_url = self.config.get(section="Coordination",
+                                                       option="consul_url",
+                                                       fallback=DEFAULT_COORDINATION_CONSUL_URL)
+
+        self.coordination_consul_key_prefix = self.config.get(section="Coordination",
+                                                              option="consul_key_prefix",
+                                                              fallback=DEFAULT_COORDINATION_CONSUL_KEY_PREFIX)
+
+        self.coordination_consul_token = self.config.get(section="Coordination",
+                                                         option="consul_token",
+                                                         fallback=DEFAULT_COORDINATION_CONSUL_TOKEN)
+
+        #
+        # Hook Sections
+        #
+        self.pre_vmotion_hook_policy = self._hook_policy(section="PreVmotionHook")
+        self.post_vmotion_hook_policy = self._hook_policy(section="PostVmotionHook")
+
+        #
+        # Warmup Section
+        #
+        self.warmup_enabled = self.config.getboolean(section="Warmup",
+                                                     option="enabled",
+                                                     fallback=DEFAULT_WARMUP_ENABLED)
+
+        self.warmup_max_workers = self.config.getint(section="Warmup",
+                                                     option="max_workers",
+                                                     fallback=DEFAULT_WARMUP_MAX_WORKERS)
+
+        self.warmup_deadline_seconds = self.config.getfloat(section="Warmup",
+                                                            option="deadline_seconds",
+                                                            fallback=DEFAULT_WARMUP_DEADLINE_SECONDS)
+
+        self.warmup_probe_cmd = self.config.get(section="Warmup",
+                                                option="probe_cmd",
+                                                fallback=DEFAULT_WARMUP_PROBE_CMD)
+
+        self.warmup_target_latency_ms = self.config.getfloat(section="Warmup",
+                                                             option="target_latency_ms",
+                                                             fallback=None)
+
+        self.warmup_probe_interval_seconds = self.config.getfloat(section="Warmup",
+                                                                  option="probe_interval_seconds",
+                                                                  fallback=DEFAULT_WARMUP_PROBE_INTERVAL_SECONDS)
+
+        self.warmup_ready_cmd = self.config.get(section="Warmup",
+                                                option="ready_cmd",
+                                                fallback=DEFAULT_WARMUP_READY_CMD)
+
+        self.warmup_curve_file = self.config.get(section="Warmup",
+                                                 option="curve_file",
+                                                 fallback=DEFAULT_WARMUP_CURVE_FILE)
+
+        self.warmup_tasks = self._warmup_tasks()
+
+        #
+        # Control Section
+        #
+        self.control_enabled = self.config.getboolean(section="Control",
+                                                      option="enabled",
+                                                      fallback=DEFAULT_CONTROL_ENABLED)
+
+        self.control_socket = self.config.get(section="Control",
+                                              option="socket",
+                                              fallback=DEFAULT_CONTROL_SOCKET)
+
+        self.control_list_ttl_seconds = self.config.getfloat(section="Control",
+                                                             option="list_ttl_seconds",
+                                                             fallback=DEFAULT_CONTROL_LIST_TTL_SECONDS)
+
+        #
+        # Transcript Section
+        #
+        self.transcript_enabled = self.config.getboolean(section="Transcript",
+                                                         option="enabled",
+                                                         fallback=DEFAULT_TRANSCRIPT_ENABLED)
+
+        self.transcript_file = self.config.get(section="Transcript",
+                                               option="transcript_file",
+                                               fallback=DEFAULT_TRANSCRIPT_FILE)
+
+    def _hook_policy(self, section: str) -> dict:
+        """ Read the execution policy of a hook, only the options that are set. """
+        if not self.config.has_section(section):
+            return {}
+
+        policy = {}
+        for option in ("nice", "ionice_level", "sched_priority", "cpu_weight", "io_weight"):
+            if self.config.has_option(section, option):
+                policy[option] = self.config.getint(section=section, option=option)
+        for option in ("ionice_class", "sched_policy", "cgroup", "throttle_cpu_max"):
+            if self.config.has_option(section, option):
+                policy[option] = self.config.get(section=section, option=option).strip() or None
+        if self.config.has_option(section, "throttle_cgroups"):
+            value = self.config.get(section=section, option="throttle_cgroups")
+            policy["throttle_cgroups"] = [c.strip() for c in value.split(",") if c.strip()]
+        if self.config.has_option(section, "baseline_seconds"):
+            policy["baseline_seconds"] = self.config.getfloat(section=section, option="baseline_seconds")
+        return {k: v for k, v in policy.items() if v is not None}
+
+    def _warmup_tasks(self) -> list:
+        """ Read the warm-up tasks, one [Warmup:<name>] section per task. """
+        tasks = []
+        for section in self.config.sections():
+            if not section.startswith(WARMUP_TASK_SECTION_PREFIX):
+                continue
+            task = {"name": section[len(WARMUP_TASK_SECTION_PREFIX):].strip()}
+            for option in ("type", "command", "keys_file", "template"):
+                if self.config.has_option(section, option):
+                    task[option] = self.config.get(section=section, option=option, raw=True).strip()
+            if self.config.has_option(section, "paths"):
+                value = self.config.get(section=section, option="paths")
+                task["paths"] = [p.strip() for p in value.replace("\n", ",").split(",") if p.strip()]
+            tasks.append(task)
+        return tasks
+
+    @classmethod
+    def options(cls) -> list:
+        """ Names of all the configuration options. """
+        return [k for k, v in vars(cls).items() if isinstance(v, property)]
+
+    @classmethod
+    def from_json(cls, values: dict) -> "VMNotificationConfig":
+        """ Create a configuration from the output of json(), without parsing the configuration file. """
+        config = cls.__new__(cls)
+        config.config_file = values["config_file"]
+        config.config = None
+        for option in cls.options():
+            setattr(config, option, values[option])
+        return config
+
+    @staticmethod
+    def code_version() -> list:
+        """ Modification time and size of the modules defining the options, to invalidate a snapshot on upgrade. """
+        version = []
+        for module in CONFIG_SNAPSHOT_MODULES:
+            stat = os.stat(Path(__file__).with_name(module))
+            version.append([module, stat.st_mtime_ns, stat.st_size])
+        return version
+
+    @classmethod
+    def load(cls, config_file: str, snapshot_file: Optional[str] = None) -> "VMNotificationConfig":
+        """
+        Load the configuration from its snapshot if the configuration file did not change since the snapshot was
+        saved, otherwise parse the configuration file. The snapshot holds already validated values, which skips
+        the configparser import and parsing on startup.
+        """
+        if snapshot_file:
+            try:
+                stat = os.stat(config_file)
+                with Path(snapshot_file).open(mode='r', encoding="utf-8") as f:
+                    snapshot = json.load(f)
+                if (snapshot.get("code_version") == cls.code_version()
+                        and snapshot.get("config_file") == os.path.abspath(config_file)
+                        and snapshot.get("mtime_ns") == stat.st_mtime_ns
+                        and snapshot.get("size") == stat.st_size):
+                    return cls.from_json(snapshot["config"])
+            except (OSError, ValueError, KeyError, TypeError):
+                # Missing, outdated or invalid snapshot
+                pass
+
+        return cls(config_file=config_file)
+
+    def save_snapshot(self, snapshot_file: str):
+        try:
+            stat = os.stat(self.config_file)
+            snapshot = {
+                "code_version": self.code_version(),
+                "config_file": os.path.abspath(self.config_file),
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "config": self.json(secrets=True),
+            }
+            p = Path(snapshot_file)
+            p.parent.mkdir(parents=True, exist_ok=True)
+            tmp = p.with_name(f".{p.name}.tmp")
+            # The snapshot holds the secrets of the configuration file, e.g. the Consul token
+            tmp.unlink(missing_ok=True)
+            with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), mode='w', encoding="utf-8") as f:
+                json.dump(snapshot, f)
+            tmp.replace(p)
+        except OSError as e:
+            print(f"Could not save the configuration snapshot '{snapshot_file}': {e}")
+
+    def json(self, secrets: bool = False):
+        """ Values of all the options, with the secrets masked unless 'secrets', e.g. to log them. """
+        consul_token = self.coordination_consul_token
+        if consul_token and not secrets:
+            consul_token = "********"
         return {
             "config_file": self.config_file,
             "app_name": self.app_name,
@@ -125,6 +420,40 @@ class VMNotificationConfig(object):
             "timeout_logfile": self.timeout_logfile,
             "timeout_logfile_maxsize_bytes": self.timeout_logfile_maxsize_bytes,
             "timeout_logfile_count": self.timeout_logfile_count,
+            "tracing_exporter": self.tracing_exporter,
+            "tracing_otlp_endpoint": self.tracing_otlp_endpoint,
+            "tracing_otlp_timeout_seconds": self.tracing_otlp_timeout_seconds,
+            "tracing_file": self.tracing_file,
+            "coordination_enabled": self.coordination_enabled,
+            "coordination_backend": self.coordination_backend,
+            "coordination_group": self.coordination_group,
+            "coordination_member_id": self.coordination_member_id,
+            "coordination_max_concurrent_drains": self.coordination_max_concurrent_drains,
+            "coordination_lease_ttl_seconds": self.coordination_lease_ttl_seconds,
+            "coordination_retry_interval_seconds": self.coordination_retry_interval_seconds,
+            "coordination_budget_margin_seconds": self.coordination_budget_margin_seconds,
+            "coordination_max_migration_seconds": self.coordination_max_migration_seconds,
+            "coordination_lease_file": self.coordination_lease_file,
+            "coordination_sqlite_database": self.coordination_sqlite_database,
+            "coordination_consul_url": self.coordination_consul_url,
+            "coordination_consul_key_prefix": self.coordination_consul_key_prefix,
+            "coordination_consul_token": consul_token,
+            "pre_vmotion_hook_policy": self.pre_vmotion_hook_policy,
+            "post_vmotion_hook_policy": self.post_vmotion_hook_policy,
+            "warmup_enabled": self.warmup_enabled,
+            "warmup_max_workers": self.warmup_max_workers,
+            "warmup_deadline_seconds": self.warmup_deadline_seconds,
+            "warmup_probe_cmd": self.warmup_probe_cmd,
+            "warmup_target_latency_ms": self.warmup_target_latency_ms,
+            "warmup_probe_interval_seconds": self.warmup_probe_interval_seconds,
+            "warmup_ready_cmd": self.warmup_ready_cmd,
+            "warmup_curve_file": self.warmup_curve_file,
+            "warmup_tasks": self.warmup_tasks,
+            "control_enabled": self.control_enabled,
+            "control_socket": self.control_socket,
+            "control_list_ttl_seconds": self.control_list_ttl_seconds,
+            "transcript_enabled": self.transcript_enabled,
+            "transcript_file": self.transcript_file,
         }
 
     def print(self):
@@ -326,3 +655,371 @@ class VMNotificationConfig(object):
         if timeout_logfile_count < 2:
             raise ValueError(f"timeout_logfile_count must be greater than 1 (was {timeout_logfile_count}).")
         self._timeout_logfile_count = timeout_logfile_count
+
+    @property
+    def tracing_exporter(self) -> str:
+        return self._tracing_exporter
+
+    @tracing_exporter.setter
+    def tracing_exporter(self, tracing_exporter: str):
+        if not isinstance(tracing_exporter, str) or tracing_exporter.lower() not in TRACING_EXPORTERS:
+            raise ValueError(f"tracing_exporter must be one of {TRACING_EXPORTERS} (input: '{tracing_exporter}')")
+        self._tracing_exporter = tracing_exporter.lower()
+
+    @property
+    def tracing_otlp_endpoint(self) -> str:
+        return self._tracing_otlp_endpoint
+
+    @tracing_otlp_endpoint.setter
+    def tracing_otlp_endpoint(self, tracing_otlp_endpoint: str):
+        if not isinstance(tracing_otlp_endpoint, str) or not tracing_otlp_endpoint.startswith(("http://", "https://")):
+            raise ValueError(f"tracing_otlp_endpoint must be an http(s) URL (input: '{tracing_otlp_endpoint}')")
+        self._tracing_otlp_endpoint = tracing_otlp_endpoint
+
+    @property
+    def tracing_otlp_timeout_seconds(self) -> float:
+        return self._tracing_otlp_timeout_seconds
+
+    @tracing_otlp_timeout_seconds.setter
+    def tracing_otlp_timeout_seconds(self, tracing_otlp_timeout_seconds: float):
+        if not isinstance(tracing_otlp_timeout_seconds, (int, float)):
+            raise ValueError(f"tracing_otlp_timeout_seconds must be a number (input: '{tracing_otlp_timeout_seconds}')")
+        if tracing_otlp_timeout_seconds <= 0:
+            raise ValueError(f"tracing_otlp_timeout_seconds must be greater than 0 (was {tracing_otlp_timeout_seconds}).")
+        self._tracing_otlp_timeout_seconds = float(tracing_otlp_timeout_seconds)
+
+    @property
+    def tracing_file(self) -> str:
+        return self._tracing_file
+
+    @tracing_file.setter
+    def tracing_file(self, tracing_file: str):
+        if not isinstance(tracing_file, str) or len(tracing_file) < 1:
+            raise ValueError(f"tracing_file must be a string with at least 1 character (input: '{tracing_file}')")
+        self._tracing_file = tracing_file
+
+    @property
+    def coordination_enabled(self) -> bool:
+        return self._coordination_enabled
+
+    @coordination_enabled.setter
+    def coordination_enabled(self, coordination_enabled: bool):
+        if not isinstance(coordination_enabled, bool):
+            raise ValueError(f"coordination_enabled must be a boolean (input: '{coordination_enabled}')")
+        self._coordination_enabled = coordination_enabled
+
+    @property
+    def coordination_backend(self) -> str:
+        return self._coordination_backend
+
+    @coordination_backend.setter
+    def coordination_backend(self, coordination_backend: str):
+        if not isinstance(coordination_backend, str) or coordination_backend.lower() not in COORDINATION_BACKENDS:
+            raise ValueError(f"coordination_backend must be one of {COORDINATION_BACKENDS} (input: '{coordination_backend}')")
+        self._coordination_backend = coordination_backend.lower()
+
+    @property
+    def coordination_group(self) -> str:
+        return self._coordination_group
+
+    @coordination_group.setter
+    def coordination_group(self, coordination_group: str):
+        if not isinstance(coordination_group, str) or len(coordination_group) < 1:
+            raise ValueError(f"coordination_group must be a string with at least 1 character (input: '{coordination_group}')")
+        self._coordination_group = coordination_group
+
+    @property
+    def coordination_member_id(self) -> str:
+        return self._coordination_member_id
+
+    @coordination_member_id.setter
+    def coordination_member_id(self, coordination_member_id: str):
+        if not isinstance(coordination_member_id, str):
+            raise ValueError(f"coordination_member_id must be a string (input: '{coordination_member_id}')")
+        self._coordination_member_id = coordination_member_id
+
+    @property
+    def coordination_max_concurrent_drains(self) -> int:
+        return self._coordination_max_concurrent_drains
+
+    @coordination_max_concurrent_drains.setter
+    def coordination_max_concurrent_drains(self, coordination_max_concurrent_drains: int):
+        if not isinstance(coordination_max_concurrent_drains, int):
+            raise ValueError(f"coordination_max_concurrent_drains must be an integer (input: '{coordination_max_concurrent_drains}')")
+        if coordination_max_concurrent_drains < 1:
+            raise ValueError(f"coordination_max_concurrent_drains must be greater than or equal to 1 (was {coordination_max_concurrent_drains}).")
+        self._coordination_max_concurrent_drains = coordination_max_concurrent_drains
+
+    @property
+    def coordination_lease_ttl_seconds(self) -> int:
+        return self._coordination_lease_ttl_seconds
+
+    @coordination_lease_ttl_seconds.setter
+    def coordination_lease_ttl_seconds(self, coordination_lease_ttl_seconds: int):
+        if not isinstance(coordination_lease_ttl_seconds, int):
+            raise ValueError(f"coordination_lease_ttl_seconds must be an integer (input: '{coordination_lease_ttl_seconds}')")
+        if coordination_lease_ttl_seconds < 1:
+            raise ValueError(f"coordination_lease_ttl_seconds must be greater than or equal to 1 (was {coordination_lease_ttl_seconds}).")
+        self._coordination_lease_ttl_seconds = coordination_lease_ttl_seconds
+
+    @property
+    def coordination_retry_interval_seconds(self) -> float:
+        return self._coordination_retry_interval_seconds
+
+    @coordination_retry_interval_seconds.setter
+    def coordination_retry_interval_seconds(self, coordination_retry_interval_seconds: float):
+        if not isinstance(coordination_retry_interval_seconds, (int, float)):
+            raise ValueError(f"coordination_retry_interval_seconds must be a number (input: '{coordination_retry_interval_seconds}')")
+        if coordination_retry_interval_seconds <= 0:
+            raise ValueError(f"coordination_retry_interval_seconds must be greater than 0 (was {coordination_retry_interval_seconds}).")
+        self._coordination_retry_interval_seconds = float(coordination_retry_interval_seconds)
+
+    @property
+    def coordination_budget_margin_seconds(self) -> float:
+        return self._coordination_budget_margin_seconds
+
+    @coordination_budget_margin_seconds.setter
+    def coordination_budget_margin_seconds(self, coordination_budget_margin_seconds: float):
+        if not isinstance(coordination_budget_margin_seconds, (int, float)):
+            raise ValueError(f"coordination_budget_margin_seconds must be a number (input: '{coordination_budget_margin_seconds}')")
+        if coordination_budget_margin_seconds < 0:
+            raise ValueError(f"coordination_budget_margin_seconds must be greater than or equal to 0 (was {coordination_budget_margin_seconds}).")
+        self._coordination_budget_margin_seconds = float(coordination_budget_margin_seconds)
+
+    @property
+    def coordination_max_migration_seconds(self) -> int:
+        return self._coordination_max_migration_seconds
+
+    @coordination_max_migration_seconds.setter
+    def coordination_max_migration_seconds(self, coordination_max_migration_seconds: int):
+        if not isinstance(coordination_max_migration_seconds, int):
+            raise ValueError(f"coordination_max_migration_seconds must be an integer (input: '{coordination_max_migration_seconds}')")
+        if coordination_max_migration_seconds < 1:
+            raise ValueError(f"coordination_max_migration_seconds must be greater than or equal to 1 (was {coordination_max_migration_seconds}).")
+        self._coordination_max_migration_seconds = coordination_max_migration_seconds
+
+    @property
+    def coordination_lease_file(self) -> str:
+        return self._coordination_lease_file
+
+    @coordination_lease_file.setter
+    def coordination_lease_file(self, coordination_lease_file: str):
+        if not isinstance(coordination_lease_file, str) or len(coordination_lease_file) < 1:
+            raise ValueError(f"coordination_lease_file must be a string with at least 1 character (input: '{coordination_lease_file}')")
+        self._coordination_lease_file = coordination_lease_file
+
+    @property
+    def coordination_sqlite_database(self) -> str:
+        return self._coordination_sqlite_database
+
+    @coordination_sqlite_database.setter
+    def coordination_sqlite_database(self, coordination_sqlite_database: str):
+        if not isinstance(coordination_sqlite_database, str) or len(coordination_sqlite_database) < 1:
+            raise ValueError(f"coordination_sqlite_database must be a string with at least 1 character (input: '{coordination_sqlite_database}')")
+        self._coordination_sqlite_database = coordination_sqlite_database
+
+    @property
+    def coordination_consul_url(self) -> str:
+        return self._coordination_consul_url
+
+    @coordination_consul_url.setter
+    def coordination_consul_url(self, coordination_consul_url: str):
+        if not isinstance(coordination_consul_url, str) or len(coordination_consul_url) < 1:
+            raise ValueError(f"coordination_consul_url must be a string with at least 1 character (input: '{coordination_consul_url}')")
+        self._coordination_consul_url = coordination_consul_url
+
+    @property
+    def coordination_consul_key_prefix(self) -> str:
+        return self._coordination_consul_key_prefix
+
+    @coordination_consul_key_prefix.setter
+    def coordination_consul_key_prefix(self, coordination_consul_key_prefix: str):
+        if not isinstance(coordination_consul_key_prefix, str) or len(coordination_consul_key_prefix) < 1:
+            raise ValueError(f"coordination_consul_key_prefix must be a string with at least 1 character (input: '{coordination_consul_key_prefix}')")
+        self._coordination_consul_key_prefix = coordination_consul_key_prefix
+
+    @property
+    def coordination_consul_token(self) -> str:
+        return self._coordination_consul_token
+
+    @coordination_consul_token.setter
+    def coordination_consul_token(self, coordination_consul_token: str):
+        if not isinstance(coordination_consul_token, str):
+            raise ValueError(f"coordination_consul_token must be a string (input: '{coordination_consul_token}')")
+        self._coordination_consul_token = coordination_consul_token
+
+    @staticmethod
+    def _validate_hook_policy(name: str, policy: dict):
+        if isinstance(policy, dict) and not policy:
+            return
+        # Only imported when a hook policy is configured, to keep the startup lean
+        from vmnotification_hook_policy import validate_hook_policy
+
+        validate_hook_policy(name, policy)
+
+    @property
+    def pre_vmotion_hook_policy(self) -> dict:
+        return self._pre_vmotion_hook_policy
+
+    @pre_vmotion_hook_policy.setter
+    def pre_vmotion_hook_policy(self, pre_vmotion_hook_policy: dict):
+        self._validate_hook_policy("pre_vmotion_hook_policy", pre_vmotion_hook_policy)
+        self._pre_vmotion_hook_policy = pre_vmotion_hook_policy
+
+    @property
+    def post_vmotion_hook_policy(self) -> dict:
+        return self._post_vmotion_hook_policy
+
+    @post_vmotion_hook_policy.setter
+    def post_vmotion_hook_policy(self, post_vmotion_hook_policy: dict):
+        self._validate_hook_policy("post_vmotion_hook_policy", post_vmotion_hook_policy)
+        self._post_vmotion_hook_policy = post_vmotion_hook_policy
+
+    @property
+    def warmup_enabled(self) -> bool:
+        return self._warmup_enabled
+
+    @warmup_enabled.setter
+    def warmup_enabled(self, warmup_enabled: bool):
+        if not isinstance(warmup_enabled, bool):
+            raise ValueError(f"warmup_enabled must be a boolean (input: '{warmup_enabled}')")
+        self._warmup_enabled = warmup_enabled
+
+    @property
+    def warmup_max_workers(self) -> int:
+        return self._warmup_max_workers
+
+    @warmup_max_workers.setter
+    def warmup_max_workers(self, warmup_max_workers: int):
+        if not isinstance(warmup_max_workers, int) or warmup_max_workers < 1:
+            raise ValueError(f"warmup_max_workers must be an integer greater than 0 (input: '{warmup_max_workers}')")
+        self._warmup_max_workers = warmup_max_workers
+
+    @property
+    def warmup_deadline_seconds(self) -> float:
+        return self._warmup_deadline_seconds
+
+    @warmup_deadline_seconds.setter
+    def warmup_deadline_seconds(self, warmup_deadline_seconds: float):
+        if not isinstance(warmup_deadline_seconds, (int, float)) or warmup_deadline_seconds <= 0:
+            raise ValueError(f"warmup_deadline_seconds must be greater than 0 (input: '{warmup_deadline_seconds}')")
+        self._warmup_deadline_seconds = float(warmup_deadline_seconds)
+
+    @property
+    def warmup_probe_cmd(self) -> str:
+        return self._warmup_probe_cmd
+
+    @warmup_probe_cmd.setter
+    def warmup_probe_cmd(self, warmup_probe_cmd: str):
+        if not isinstance(warmup_probe_cmd, str):
+            raise ValueError(f"warmup_probe_cmd must be a string (input: '{warmup_probe_cmd}')")
+        self._warmup_probe_cmd = warmup_probe_cmd
+
+    @property
+    def warmup_target_latency_ms(self) -> Optional[float]:
+        return self._warmup_target_latency_ms
+
+    @warmup_target_latency_ms.setter
+    def warmup_target_latency_ms(self, warmup_target_latency_ms: Optional[float]):
+        if warmup_target_latency_ms is not None and (not isinstance(warmup_target_latency_ms, (int, float))
+                                                     or warmup_target_latency_ms <= 0):
+            raise ValueError(f"warmup_target_latency_ms must be greater than 0 (input: '{warmup_target_latency_ms}')")
+        self._warmup_target_latency_ms = warmup_target_latency_ms
+
+    @property
+    def warmup_probe_interval_seconds(self) -> float:
+        return self._warmup_probe_interval_seconds
+
+    @warmup_probe_interval_seconds.setter
+    def warmup_probe_interval_seconds(self, warmup_probe_interval_seconds: float):
+        if not isinstance(warmup_probe_interval_seconds, (int, float)) or warmup_probe_interval_seconds <= 0:
+            raise ValueError(f"warmup_probe_interval_seconds must be greater than 0 "
+                             f"(input: '{warmup_probe_interval_seconds}')")
+        self._warmup_probe_interval_seconds = float(warmup_probe_interval_seconds)
+
+    @property
+    def warmup_ready_cmd(self) -> str:
+        return self._warmup_ready_cmd
+
+    @warmup_ready_cmd.setter
+    def warmup_ready_cmd(self, warmup_ready_cmd: str):
+        if not isinstance(warmup_ready_cmd, str):
+            raise ValueError(f"warmup_ready_cmd must be a string (input: '{warmup_ready_cmd}')")
+        self._warmup_ready_cmd = warmup_ready_cmd
+
+    @property
+    def warmup_curve_file(self) -> str:
+        return self._warmup_curve_file
+
+    @warmup_curve_file.setter
+    def warmup_curve_file(self, warmup_curve_file: str):
+        if not isinstance(warmup_curve_file, str):
+            raise ValueError(f"warmup_curve_file must be a string (input: '{warmup_curve_file}')")
+        self._warmup_curve_file = warmup_curve_file
+
+    @property
+    def warmup_tasks(self) -> list:
+        return self._warmup_tasks
+
+    @warmup_tasks.setter
+    def warmup_tasks(self, warmup_tasks: list):
+        if not isinstance(warmup_tasks, list):
+            raise ValueError(f"warmup_tasks must be a list (input: '{warmup_tasks}')")
+        if warmup_tasks:
+            # Only imported when warm-up tasks are configured, to keep the startup lean
+            from vmnotification_warmup import validate_warmup_task
+
+            for task in warmup_tasks:
+                validate_warmup_task(task)
+        self._warmup_tasks = warmup_tasks
+
+    @property
+    def control_enabled(self) -> bool:
+        return self._control_enabled
+
+    @control_enabled.setter
+    def control_enabled(self, control_enabled: bool):
+        if not isinstance(control_enabled, bool):
+            raise ValueError(f"control_enabled must be a boolean (input: '{control_enabled}')")
+        self._control_enabled = control_enabled
+
+    @property
+    def control_socket(self) -> str:
+        return self._control_socket
+
+    @control_socket.setter
+    def control_socket(self, control_socket: str):
+        if not isinstance(control_socket, str) or len(control_socket) < 1:
+            raise ValueError(f"control_socket must be a string with at least 1 character (input: '{control_socket}')")
+        self._control_socket = control_socket
+
+    @property
+    def control_list_ttl_seconds(self) -> float:
+        return self._control_list_ttl_seconds
+
+    @control_list_ttl_seconds.setter
+    def control_list_ttl_seconds(self, control_list_ttl_seconds: float):
+        if not isinstance(control_list_ttl_seconds, (int, float)) or control_list_ttl_seconds < 0:
+            raise ValueError(f"control_list_ttl_seconds must be greater than or equal to 0 "
+                             f"(input: '{control_list_ttl_seconds}')")
+        self._control_list_ttl_seconds = float(control_list_ttl_seconds)
+
+    @property
+    def transcript_enabled(self) -> bool:
+        return self._transcript_enabled
+
+    @transcript_enabled.setter
+    def transcript_enabled(self, transcript_enabled: bool):
+        if not isinstance(transcript_enabled, bool):
+            raise ValueError(f"transcript_enabled must be a boolean (input: '{transcript_enabled}')")
+        self._transcript_enabled = transcript_enabled
+
+    @property
+    def transcript_file(self) -> str:
+        return self._transcript_file
+
+    @transcript_file.setter
+    def transcript_file(self, transcript_file: str):
+        if not isinstance(transcript_file, str) or len(transcript_file) < 1:
+            raise ValueError(f"transcript_file must be a string with at least 1 character (input: '{transcript_file}')")
+        self._transcript_file = transcript_file
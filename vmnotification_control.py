@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import stat
+import sys
+import threading
+from time import monotonic
+from typing import Optional
+
+from vmnotification_exception import VMNotificationException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTROL_SOCKET = "/var/run/vmnotification/control.sock"
+CONTROL_COMMANDS = ("status", "pending", "drain-now", "pause", "resume")
+MAX_REQUEST_BYTES = 64 * 1024
+
+
+class ControlServer(object):
+    """
+    Local control socket of the service, used by 'vmnotification ctl'. One JSON request per connection, e.g.
+    {"command": "status"}, answered with one JSON reply in the format of the host replies:
+    {"result": true, ...} or {"result": false, "errorMessage": "..."}.
+
+    Queries are answered from the in-memory state of the service. The registrations reported by the host
+    ('vm-operation-notification.list') are cached for 'list_ttl_seconds', so queries never add RPCs to the host
+    beyond one per TTL. A drain rehearsal (drain-now) runs in the polling loop, between two polls.
+    """
+
+    def __init__(self, service, socket_path: str = DEFAULT_CONTROL_SOCKET, list_ttl_seconds: float = 30):
+        self.service = service
+        self.socket_path = socket_path
+        self.list_ttl_seconds = list_ttl_seconds
+        self.__server = None
+        self.__thread = None
+        self.__list_lock = threading.Lock()
+        self.__list = None
+        self.__list_time = None
+
+    def start(self):
+        import socketserver
+
+        control = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline(MAX_REQUEST_BYTES))
+                except ValueError as e:
+                    reply = {"result": False, "errorMessage": f"Invalid request, not JSON ({e})"}
+                else:
+                    reply = control.handle(request)
+                self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+        # Remove the socket left by a previous process, e.g. before an upgrade
+        try:
+            if stat.S_ISSOCK(os.stat(self.socket_path).st_mode):
+                os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+        # Drain rehearsals run the hooks, restrict the socket to the owner of the service from its creation
+        umask = os.umask(0o077)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        finally:
+            os.umask(umask)
+        server.daemon_threads = True
+        self.__server = server
+        self.__thread = threading.Thread(target=server.serve_forever, name="control", daemon=True)
+        self.__thread.start()
+        logger.debug(f"start: Listening on '{self.socket_path}'")
+
+    def close(self):
+        if self.__server is None:
+            return
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__server = None
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    def registrations(self) -> tuple:
+        """ Return the cached 'list' reply and its age in seconds, refreshed once older than the TTL. """
+        with self.__list_lock:
+            if self.__list is None or monotonic() - self.__list_time >= self.list_ttl_seconds:
+                reply = self.service.list_registrations()
+                self.__list = {k: v for k, v in reply.items() if k != "result"}
+                self.__list_time = monotonic()
+            return self.__list, round(monotonic() - self.__list_time, 3)
+
+    def pending(self) -> dict:
+        status = self.service.status()
+        registrations, age = self.registrations()
+        return {
+            "phase": status["phase"],
+            "paused": status["paused"],
+            "operation": status["operation"],
+            "registrations": registrations,
+            "registrations_age_seconds": age,
+        }
+
+    def handle(self, request: dict) -> dict:
+        command = request.get("command") if isinstance(request, dict) else None
+        logger.debug(f"handle: Control request '{command}'")
+        try:
+            match command:
+                case "status":
+                    reply = self.service.status()
+                case "pending":
+                    reply = self.pending()
+                case "drain-now":
+                    lease_timeout_seconds = request.get("lease_timeout_seconds", 60)
+                    if isinstance(lease_timeout_seconds, bool) or not isinstance(lease_timeout_seconds, (int, float)):
+                        return {"result": False, "errorMessage": f"lease_timeout_seconds must be a number "
+                                                                 f"(input: '{lease_timeout_seconds}')"}
+                    reply = self.service.call_in_loop(self.service.rehearse_drain, lease_timeout_seconds)
+                case "pause":
+                    self.service.pause()
+                    reply = {"paused": True}
+                case "resume":
+                    self.service.resume()
+                    reply = {"paused": False}
+                case _:
+                    return {"result": False,
+                            "errorMessage": f"Unknown command '{command}', expected one of {CONTROL_COMMANDS}"}
+        except VMNotificationException as e:
+            logger.warning(f"handle: Control request '{command}' failed: {e}")
+            return {"result": False, "errorMessage": str(e)}
+        except Exception as e:
+            logger.error(f"handle: Control request '{command}' failed unexpectedly: {type(e).__name__}: {e}")
+            return {"result": False, "errorMessage": str(e)}
+        return {"result": True, **reply}
+
+
+def request(command: str, socket_path: str = DEFAULT_CONTROL_SOCKET, timeout: Optional[float] = None,
+            **params) -> dict:
+    """ Send a request to the control socket of the running service and return its reply. """
+    import socket
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({"command": command, **params}).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise VMNotificationException("No reply from the service")
+    return json.loads(line)
+
+
+def main(argv: list) -> int:
+    """ 'vmnotification ctl' client. """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='vmnotification ctl',
+                                     description='Query and control the running vMotion notification service')
+    parser.add_argument('--socket', type=str, default=DEFAULT_CONTROL_SOCKET)
+    parser.add_argument('--timeout', type=float, default=None,
+                        help="Seconds to wait for a reply (default: 10, no limit for drain-now)")
+    parser.add_argument('--lease-timeout', type=float, default=60,
+                        help="drain-now: seconds to wait for a drain lease, with drain coordination")
+    parser.add_argument('command', choices=CONTROL_COMMANDS)
+    args = parser.parse_args(argv)
+
+    params = {}
+    timeout = args.timeout
+    if args.command == "drain-now":
+        params["lease_timeout_seconds"] = args.lease_timeout
+    elif timeout is None:
+        timeout = 10
+
+    try:
+        reply = request(args.command, socket_path=args.socket, timeout=timeout, **params)
+    except (OSError, ValueError, VMNotificationException) as e:
+        print(f"Could not reach the service on '{args.socket}': {e}", file=sys.stderr)
+        return 2
+
+    print(json.dumps(reply, indent=2))
+    return 0 if reply.get("result") else 1
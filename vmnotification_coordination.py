@@ -0,0 +1,335 @@
+import json
+import logging
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from time import sleep
+from typing import Optional
+
+from vmnotification_exception import VMNotificationCoordinationException
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseBackend(ABC):
+    """
+    Storage for the drain leases of a group of applications. A lease is held by a member (one VM running the
+    service) until it is released or until it expires. At most 'max_holders' members hold a lease at any time.
+    """
+
+    @abstractmethod
+    def acquire(self, group: str, member_id: str, max_holders: int, ttl_seconds: int) -> bool:
+        """ Acquire or renew the lease of 'member_id'. Return True if the member holds a lease. """
+
+    @abstractmethod
+    def release(self, group: str, member_id: str):
+        pass
+
+    @abstractmethod
+    def holders(self, group: str) -> dict:
+        """ Return the current lease holders and their expiry time (epoch). """
+
+    @staticmethod
+    def _update(holders: dict, member_id: str, max_holders: int, ttl_seconds: int, now: float) -> bool:
+        # Drop expired leases, then renew or add the member if there is a free slot
+        for k in [k for k, expires in holders.items() if expires <= now]:
+            del holders[k]
+        if member_id not in holders and len(holders) >= max_holders:
+            return False
+        holders[member_id] = now + ttl_seconds
+        return True
+
+
+class FileLeaseBackend(LeaseBackend):
+    """
+    Leases stored in a JSON file protected by an exclusive lock. The file must be reachable by all the members of
+    the group (e.g. a shared mount), which makes this backend mostly useful for testing on a single host.
+    """
+
+    def __init__(self, lease_file: str):
+        self.lease_file = lease_file
+
+    def _locked(self, group: str, update):
+        import fcntl
+
+        p = Path(self.lease_file)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        with p.open(mode='a+', encoding="utf-8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                leases = json.loads(content) if content.strip() else {}
+                holders = leases.setdefault(group, {})
+                result = update(holders)
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(leases))
+                f.flush()
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self, group: str, member_id: str, max_holders: int, ttl_seconds: int) -> bool:
+        return self._locked(group, lambda holders: self._update(holders, member_id, max_holders, ttl_seconds, time.time()))
+
+    def release(self, group: str, member_id: str):
+        self._locked(group, lambda holders: holders.pop(member_id, None))
+
+    def holders(self, group: str) -> dict:
+        now = time.time()
+        return {k: v for k, v in self._locked(group, lambda holders: dict(holders)).items() if v > now}
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """ Leases stored in a SQLite database. Like the file backend, the database must be shared by all the members. """
+
+    def __init__(self, database: str):
+        self.database = database
+
+    def _connect(self):
+        import sqlite3
+
+        Path(self.database).parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.database, timeout=10, isolation_level=None)
+        connection.execute("CREATE TABLE IF NOT EXISTS leases ("
+                           "grp TEXT NOT NULL, member TEXT NOT NULL, expires REAL NOT NULL, PRIMARY KEY (grp, member))")
+        return connection
+
+    def acquire(self, group: str, member_id: str, max_holders: int, ttl_seconds: int) -> bool:
+        now = time.time()
+        connection = self._connect()
+        try:
+            # BEGIN IMMEDIATE takes the write lock, so the count and the insert are atomic
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM leases WHERE grp = ? AND expires <= ?", (group, now))
+            holding = connection.execute("SELECT COUNT(*) FROM leases WHERE grp = ? AND member = ?",
+                                         (group, member_id)).fetchone()[0]
+            count = connection.execute("SELECT COUNT(*) FROM leases WHERE grp = ?", (group,)).fetchone()[0]
+            if not holding and count >= max_holders:
+                connection.execute("COMMIT")
+                return False
+            connection.execute("INSERT OR REPLACE INTO leases (grp, member, expires) VALUES (?, ?, ?)",
+                               (group, member_id, now + ttl_seconds))
+            connection.execute("COMMIT")
+            return True
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def release(self, group: str, member_id: str):
+        connection = self._connect()
+        try:
+            connection.execute("DELETE FROM leases WHERE grp = ? AND member = ?", (group, member_id))
+        finally:
+            connection.close()
+
+    def holders(self, group: str) -> dict:
+        connection = self._connect()
+        try:
+            rows = connection.execute("SELECT member, expires FROM leases WHERE grp = ? AND expires > ?",
+                                      (group, time.time())).fetchall()
+            return dict(rows)
+        finally:
+            connection.close()
+
+
+class ConsulLeaseBackend(LeaseBackend):
+    """
+    Leases stored as a single JSON value per group in a Consul key-value store. Updates use check-and-set on the
+    key's ModifyIndex, so concurrent members never overwrite each other's lease.
+    """
+
+    CAS_RETRIES = 10
+
+    def __init__(self, url: str, key_prefix: str, token: str = "", timeout_seconds: float = 2.0):
+        self.url = url.rstrip("/")
+        self.key_prefix = key_prefix.strip("/")
+        self.token = token
+        self.timeout_seconds = timeout_seconds
+
+    def _request(self, method: str, key: str, query: str = "", data: bytes = None):
+        import urllib.error
+        import urllib.request
+
+        request = urllib.request.Request(f"{self.url}/v1/kv/{self.key_prefix}/{key}{query}", data=data, method=method)
+        if self.token:
+            request.add_header("X-Consul-Token", self.token)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout_seconds) as response:
+                return json.loads(response.read() or b"null")
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise VMNotificationCoordinationException(f"Consul request failed: {e}")
+        except urllib.error.URLError as e:
+            raise VMNotificationCoordinationException(f"Consul request failed: {e}")
+
+    def _read(self, group: str) -> tuple:
+        import base64
+
+        entries = self._request("GET", group)
+        if not entries:
+            return 0, {}
+        value = entries[0].get("Value")
+        holders = json.loads(base64.b64decode(value)) if value else {}
+        return entries[0].get("ModifyIndex", 0), holders
+
+    def _cas(self, group: str, update):
+        for _ in range(self.CAS_RETRIES):
+            index, holders = self._read(group)
+            result = update(holders)
+            if self._request("PUT", group, query=f"?cas={index}", data=json.dumps(holders).encode("utf-8")):
+                return result
+            logger.debug(f"_cas: Lease '{group}' was modified concurrently, retrying.")
+        raise VMNotificationCoordinationException(f"Could not update lease '{group}' after {self.CAS_RETRIES} attempts")
+
+    def acquire(self, group: str, member_id: str, max_holders: int, ttl_seconds: int) -> bool:
+        return self._cas(group, lambda holders: self._update(holders, member_id, max_holders, ttl_seconds, time.time()))
+
+    def release(self, group: str, member_id: str):
+        self._cas(group, lambda holders: holders.pop(member_id, None))
+
+    def holders(self, group: str) -> dict:
+        now = time.time()
+        return {k: v for k, v in self._read(group)[1].items() if v > now}
+
+
+class DrainCoordinator(object):
+    """
+    Limit the number of members of an application group that drain at the same time. A member must hold a lease
+    before running its pre-vmotion command and keeps it until its post-vmotion command completed, renewing it
+    while the VM migrates. The lease is released after 'max_migration_seconds' past the notification deadline
+    even without an end event, so that a lost end event never blocks the other members.
+
+    If the backend cannot be reached, the coordinator fails open and lets the member drain, as it would without
+    coordination.
+    """
+
+    def __init__(self,
+                 backend: LeaseBackend,
+                 group: str,
+                 member_id: str,
+                 max_concurrent_drains: int = 1,
+                 lease_ttl_seconds: int = 900,
+                 retry_interval_seconds: float = 1.0,
+                 budget_margin_seconds: float = 5.0,
+                 max_migration_seconds: int = 3600):
+        self.backend = backend
+        self.group = group
+        self.member_id = member_id
+        self.max_concurrent_drains = max_concurrent_drains
+        self.lease_ttl_seconds = lease_ttl_seconds
+        self.retry_interval_seconds = retry_interval_seconds
+        self.budget_margin_seconds = budget_margin_seconds
+        self.max_migration_seconds = max_migration_seconds
+        self.__holding = False
+        self.__renewed_at = 0.0
+        self.__hold_until = None
+
+    @property
+    def holding(self) -> bool:
+        return self.__holding
+
+    @property
+    def hold_until(self) -> Optional[float]:
+        """ Epoch after which the lease is no longer renewed. """
+        return self.__hold_until
+
+    def try_acquire(self) -> bool:
+        try:
+            acquired = self.backend.acquire(self.group, self.member_id, self.max_concurrent_drains,
+                                            self.lease_ttl_seconds)
+        except Exception as e:
+            logger.error(f"try_acquire: Lease backend error, draining without coordination: {e}")
+            acquired = True
+        if acquired:
+            self.__holding = True
+            self.__renewed_at = time.monotonic()
+        return acquired
+
+    def acquire(self, deadline: float) -> bool:
+        """
+        Wait for a lease until 'deadline' (epoch) minus the budget margin, which leaves time to drain and ack
+        within the notification timeout. Return False if no lease became available in time.
+        """
+        self.__hold_until = deadline + self.max_migration_seconds
+        deadline -= self.budget_margin_seconds
+        attempts = 0
+        while True:
+            attempts += 1
+            if self.try_acquire():
+                logger.debug(f"acquire: Lease for '{self.group}' acquired by '{self.member_id}' "
+                             f"after {attempts} attempt(s).")
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                logger.warning(f"acquire: No lease for '{self.group}' available within the notification budget.")
+                return False
+            logger.debug(f"acquire: {self.max_concurrent_drains} member(s) of '{self.group}' already draining, "
+                         f"retrying ({remaining:.1f}s left).")
+            sleep(min(self.retry_interval_seconds, remaining))
+
+    def adopt(self, hold_until: Optional[float] = None):
+        """ Take over the lease held by the previous process of this member after an upgrade. """
+        self.__holding = True
+        self.__renewed_at = 0.0
+        self.__hold_until = hold_until if hold_until is not None else time.time() + self.max_migration_seconds
+
+    def renew(self):
+        """ Renew the lease while it is held, at most every third of its time-to-live. """
+        if not self.__holding:
+            return
+        if self.__hold_until is not None and time.time() >= self.__hold_until:
+            logger.warning(f"renew: No vMotion end event {self.max_migration_seconds} seconds after the notification "
+                           f"deadline, releasing the lease for '{self.group}'.")
+            self.release()
+            return
+        if time.monotonic() - self.__renewed_at < self.lease_ttl_seconds / 3:
+            return
+        self.try_acquire()
+
+    def release(self):
+        if not self.__holding:
+            return
+        try:
+            self.backend.release(self.group, self.member_id)
+            logger.debug(f"release: Lease for '{self.group}' released by '{self.member_id}'.")
+        except Exception as e:
+            logger.error(f"release: Could not release the lease, it will expire in at most "
+                         f"{self.lease_ttl_seconds} seconds: {e}")
+        self.__holding = False
+        self.__hold_until = None
+
+
+def create_coordinator(backend: str,
+                       group: str,
+                       member_id: str,
+                       max_concurrent_drains: int,
+                       lease_ttl_seconds: int,
+                       retry_interval_seconds: float,
+                       budget_margin_seconds: float,
+                       max_migration_seconds: int,
+                       lease_file: str,
+                       sqlite_database: str,
+                       consul_url: str,
+                       consul_key_prefix: str,
+                       consul_token: str) -> DrainCoordinator:
+    match backend.lower():
+        case "sqlite":
+            lease_backend = SQLiteLeaseBackend(database=sqlite_database)
+        case "consul":
+            lease_backend = ConsulLeaseBackend(url=consul_url, key_prefix=consul_key_prefix, token=consul_token)
+        case _:
+            lease_backend = FileLeaseBackend(lease_file=lease_file)
+
+    return DrainCoordinator(backend=lease_backend,
+                            group=group,
+                            member_id=member_id,
+                            max_concurrent_drains=max_concurrent_drains,
+                            lease_ttl_seconds=lease_ttl_seconds,
+                            retry_interval_seconds=retry_interval_seconds,
+                            budget_margin_seconds=budget_margin_seconds,
+                            max_migration_seconds=max_migration_seconds)
@@ -2,3 +2,13 @@ class VMNotificationException(Exception):
     def __init__(self, message: str):
         # Call the base class constructor with the parameters it needs
         super().__init__(message)
+
+
+class VMNotificationCoordinationException(VMNotificationException):
+    def __init__(self, message: str):
+        super().__init__(message)
+
+
+class VMNotificationProtocolException(VMNotificationException):
+    def __init__(self, message: str):
+        super().__init__(message)
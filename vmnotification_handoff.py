@@ -0,0 +1,55 @@
+import json
+import logging
+import os
+import sys
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+HANDOFF_FD_ENV = "VMNOTIFICATION_HANDOFF_FD"
+HANDOFF_STATE_VERSION = 1
+
+
+def load_state() -> Optional[dict]:
+    """
+    Read the state handed over by the previous process on an upgrade. The state is read from the inherited file
+    descriptor named in the environment, which is removed so that it is not passed on to the hooks.
+    """
+    fd = os.environ.pop(HANDOFF_FD_ENV, None)
+    if fd is None:
+        return None
+
+    try:
+        with os.fdopen(int(fd), mode='r', encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"load_state: Could not read the handoff state from fd {fd}: {e}")
+        return None
+
+    if state.get("version") != HANDOFF_STATE_VERSION:
+        logger.error(f"load_state: Unsupported handoff state version '{state.get('version')}'")
+        return None
+
+    return state
+
+
+def reexec(state: dict):
+    """
+    Replace the running process with a new instance of the service, started with the same interpreter and
+    arguments, and hand over 'state' through an inherited pipe. This only returns if the exec failed.
+    """
+    state = dict(state, version=HANDOFF_STATE_VERSION)
+    read_fd, write_fd = os.pipe()
+    try:
+        # The state is small, so it fits in the pipe buffer and can be written before the reader exists
+        os.write(write_fd, json.dumps(state).encode("utf-8"))
+        os.close(write_fd)
+        os.set_inheritable(read_fd, True)
+        env = dict(os.environ)
+        env[HANDOFF_FD_ENV] = str(read_fd)
+        argv = [sys.executable] + sys.argv
+        logger.debug(f"reexec: Executing {argv}")
+        os.execve(sys.executable, argv, env)
+    except OSError as e:
+        logger.critical(f"reexec: Could not re-execute the service: {e}")
+        os.close(read_fd)
@@ -0,0 +1,314 @@
+import json
+import logging
+import os
+import shlex
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+# Leaf cgroup the service moves to, the controllers of a cgroup can only be enabled for its children once it holds
+# no process
+SERVICE_CGROUP = "service"
+THROTTLE_STATE_FILE = "/var/lib/vmnotification/throttled_cgroups.json"
+
+IONICE_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+SCHED_POLICIES = ("other", "batch", "idle", "fifo", "rr")
+
+
+def validate_hook_policy(name: str, policy: dict):
+    """ Validate the options of a hook execution policy, as read from the configuration file. """
+    if not isinstance(policy, dict):
+        raise ValueError(f"{name} must be a dictionary (input: '{policy}')")
+
+    nice = policy.get("nice")
+    if nice is not None and (not isinstance(nice, int) or not -20 <= nice <= 19):
+        raise ValueError(f"{name}: nice must be an integer between -20 and 19 (input: '{nice}')")
+
+    ionice_class = policy.get("ionice_class")
+    if ionice_class is not None and ionice_class not in IONICE_CLASSES:
+        raise ValueError(f"{name}: ionice_class must be one of {tuple(IONICE_CLASSES)} (input: '{ionice_class}')")
+
+    ionice_level = policy.get("ionice_level")
+    if ionice_level is not None and (not isinstance(ionice_level, int) or not 0 <= ionice_level <= 7):
+        raise ValueError(f"{name}: ionice_level must be an integer between 0 and 7 (input: '{ionice_level}')")
+
+    sched_policy = policy.get("sched_policy")
+    if sched_policy is not None and sched_policy not in SCHED_POLICIES:
+        raise ValueError(f"{name}: sched_policy must be one of {SCHED_POLICIES} (input: '{sched_policy}')")
+
+    sched_priority = policy.get("sched_priority", 0)
+    if not isinstance(sched_priority, int) or not 0 <= sched_priority <= 99:
+        raise ValueError(f"{name}: sched_priority must be an integer between 0 and 99 (input: '{sched_priority}')")
+
+    for option in ("cpu_weight", "io_weight"):
+        weight = policy.get(option)
+        if weight is not None and (not isinstance(weight, int) or not 1 <= weight <= 10000):
+            raise ValueError(f"{name}: {option} must be an integer between 1 and 10000 (input: '{weight}')")
+
+    throttle_cgroups = policy.get("throttle_cgroups", [])
+    if not isinstance(throttle_cgroups, list):
+        raise ValueError(f"{name}: throttle_cgroups must be a list (input: '{throttle_cgroups}')")
+
+    throttle_cpu_max = policy.get("throttle_cpu_max")
+    if throttle_cgroups and not throttle_cpu_max:
+        raise ValueError(f"{name}: throttle_cpu_max is required to throttle {throttle_cgroups}")
+
+    baseline_seconds = policy.get("baseline_seconds")
+    if baseline_seconds is not None and (not isinstance(baseline_seconds, (int, float)) or baseline_seconds <= 0):
+        raise ValueError(f"{name}: baseline_seconds must be greater than 0 (input: '{baseline_seconds}')")
+
+
+def own_cgroup(proc_file: str = "/proc/self/cgroup") -> Optional[str]:
+    """ Return the cgroup v2 of the service relative to the cgroup root, or None outside of cgroup v2. """
+    try:
+        lines = Path(proc_file).read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return None
+    for line in lines:
+        if line.startswith("0::"):
+            return line[3:].strip().strip("/")
+    return None
+
+
+def _save_throttle_state(state_file: str, state: dict) -> bool:
+    try:
+        p = Path(state_file)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        tmp = p.with_name(f".{p.name}.tmp")
+        with tmp.open(mode='w', encoding="utf-8") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.replace(p)
+        return True
+    except OSError as e:
+        logger.warning(f"_save_throttle_state: Could not save '{state_file}': {e}")
+        return False
+
+
+def restore_throttled_cgroups(state_file: str = THROTTLE_STATE_FILE) -> int:
+    """
+    Restore the CPU limit of the application cgroups left throttled by a previous process, e.g. killed by the
+    watchdog while a hook was running. Return the number of cgroups restored.
+    """
+    try:
+        with open(state_file, encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError) as e:
+        logger.error(f"restore_throttled_cgroups: Could not read '{state_file}': {e}")
+        return 0
+
+    restored = 0
+    for cpu_max, previous in state.items():
+        try:
+            Path(cpu_max).write_text(previous, encoding="utf-8")
+            restored += 1
+            logger.warning(f"restore_throttled_cgroups: Restored '{cpu_max}' to '{previous}', left throttled by a "
+                           f"previous process")
+        except OSError as e:
+            logger.error(f"restore_throttled_cgroups: Could not restore '{cpu_max}' to '{previous}': {e}")
+    try:
+        os.unlink(state_file)
+    except OSError as e:
+        logger.error(f"restore_throttled_cgroups: Could not remove '{state_file}': {e}")
+    return restored
+
+
+class HookPolicy(object):
+    """
+    How a pre or post vMotion command is executed: CPU and I/O priority, scheduling class and a dedicated cgroup v2
+    for the command, and application cgroups throttled while it runs.
+
+    The command cgroup is created under the cgroup of the service (Delegate=yes in the unit), so that systemd
+    still tracks and stops the command with the service. To set its weights, the service moves itself to the
+    'service' leaf and enables the controllers in its own cgroup, never above it.
+
+    The command is started through a shell wrapper, which moves itself to the cgroup and sets its scheduling
+    class, I/O priority and nice value before it executes the command, so that every process forked by the command
+    inherits them. Failing to apply a setting is reported in the output of the command, and never prevents the
+    command from running.
+
+    The CPU limits of the throttled cgroups are saved to 'throttle_state_file' before they are changed, and
+    restored by restore_throttled_cgroups() on the next start if the service died while the command was running.
+    """
+
+    def __init__(self,
+                 name: str,
+                 nice: Optional[int] = None,
+                 ionice_class: Optional[str] = None,
+                 ionice_level: Optional[int] = None,
+                 sched_policy: Optional[str] = None,
+                 sched_priority: int = 0,
+                 cgroup: Optional[str] = None,
+                 cpu_weight: Optional[int] = None,
+                 io_weight: Optional[int] = None,
+                 throttle_cgroups: Optional[list] = None,
+                 throttle_cpu_max: Optional[str] = None,
+                 baseline_seconds: Optional[float] = None,
+                 cgroup_root: str = CGROUP_ROOT,
+                 throttle_state_file: str = THROTTLE_STATE_FILE):
+        self.name = name
+        self.nice = nice
+        self.ionice_class = ionice_class
+        self.ionice_level = ionice_level
+        self.sched_policy = sched_policy
+        self.sched_priority = sched_priority
+        self.cgroup = cgroup.strip("/") if cgroup else None
+        self.cpu_weight = cpu_weight
+        self.io_weight = io_weight
+        self.throttle_cgroups = [c.strip("/") for c in throttle_cgroups] if throttle_cgroups else []
+        self.throttle_cpu_max = throttle_cpu_max
+        self.baseline_seconds = baseline_seconds
+        self.cgroup_root = cgroup_root
+        self.throttle_state_file = throttle_state_file
+        self.__cgroup_path = None
+
+    @classmethod
+    def from_config(cls, name: str, policy: dict) -> "HookPolicy":
+        return cls(name=name, **policy)
+
+    @property
+    def enabled(self) -> bool:
+        return any(v is not None for v in (self.nice, self.ionice_class, self.sched_policy, self.cgroup)) \
+            or bool(self.throttle_cgroups)
+
+    def describe(self) -> str:
+        if not self.enabled:
+            return "default"
+        settings = []
+        if self.nice is not None:
+            settings.append(f"nice={self.nice}")
+        if self.ionice_class is not None:
+            settings.append(f"ionice={self.ionice_class}" + (f":{self.ionice_level}" if self.ionice_level is not None else ""))
+        if self.sched_policy is not None:
+            settings.append(f"sched={self.sched_policy}:{self.sched_priority}")
+        if self.cgroup is not None:
+            settings.append(f"cgroup={self.cgroup}")
+        if self.throttle_cgroups:
+            settings.append(f"throttle={','.join(self.throttle_cgroups)}@{self.throttle_cpu_max}")
+        return " ".join(settings)
+
+    def command(self, cmd_split: list) -> list:
+        """ Return the command to run, wrapped to apply the cgroup and the priorities before it is executed. """
+        script = []
+        if self.cgroup is not None and self._setup_cgroup():
+            procs = shlex.quote(str(self.__cgroup_path / "cgroup.procs"))
+            script.append(self._or_report(f"echo $$ > {procs}", f"Could not move to cgroup {self.cgroup}"))
+
+        if self.sched_policy is not None:
+            priority = self.sched_priority if self.sched_policy in ("fifo", "rr") else 0
+            script.append(self._or_report(f"chrt --{self.sched_policy} -p {priority} $$",
+                                          f"Could not set scheduling policy {self.sched_policy}"))
+
+        if self.ionice_class is not None:
+            ionice = f"ionice -c {IONICE_CLASSES[self.ionice_class]}"
+            # The idle class has no priority level
+            if self.ionice_level is not None and self.ionice_class != "idle":
+                ionice += f" -n {self.ionice_level}"
+            script.append(self._or_report(f"{ionice} -p $$", f"Could not set ionice {self.ionice_class}"))
+
+        exec_prefix = ""
+        if self.nice is not None:
+            # nice is relative to the service, and runs the command even if it cannot set the value
+            exec_prefix = f"nice -n {self.nice - os.getpriority(os.PRIO_PROCESS, 0)} "
+
+        if not script and not exec_prefix:
+            return cmd_split
+        script.append(f'exec {exec_prefix}"$@"')
+        return ["sh", "-c", "\n".join(script), "sh"] + cmd_split
+
+    def _or_report(self, command: str, message: str) -> str:
+        return f"{command} || echo {shlex.quote(f'{self.name}: {message}')} >&2"
+
+    def _cgroup_path(self, cgroup: str) -> Path:
+        return Path(self.cgroup_root) / cgroup
+
+    def _write(self, path: Path, value: str) -> bool:
+        try:
+            path.write_text(value, encoding="utf-8")
+            return True
+        except OSError as e:
+            logger.warning(f"{self.name}: Could not write '{value}' to '{path}': {e}")
+            return False
+
+    def _setup_cgroup(self) -> bool:
+        """ Create the command cgroup under the cgroup of the service, retried on the next command if it failed. """
+        if self.__cgroup_path is not None:
+            return True
+        service_cgroup = own_cgroup()
+        if service_cgroup is not None and Path(service_cgroup).name == SERVICE_CGROUP:
+            # Already moved to the leaf, e.g. by the other hook or before an upgrade
+            service_cgroup = str(Path(service_cgroup).parent)
+        if not service_cgroup or service_cgroup == ".":
+            logger.warning(f"{self.name}: Not running in a cgroup v2 of its own (Delegate=yes), "
+                           f"cgroup '{self.cgroup}' not used")
+            return False
+
+        base = self._cgroup_path(service_cgroup)
+        path = base / self.cgroup
+        try:
+            path.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            logger.warning(f"{self.name}: Could not create cgroup '{path}': {e}")
+            return False
+
+        ok = True
+        controllers = " ".join(c for c, w in (("+cpu", self.cpu_weight), ("+io", self.io_weight)) if w is not None)
+        if controllers:
+            leaf = base / SERVICE_CGROUP
+            try:
+                leaf.mkdir(exist_ok=True)
+            except OSError as e:
+                logger.warning(f"{self.name}: Could not create cgroup '{leaf}': {e}")
+                return False
+            ok = self._write(leaf / "cgroup.procs", str(os.getpid()))
+            # Enable the controllers from the service cgroup down to the parent of the command cgroup
+            ancestor = base
+            for part in Path(self.cgroup).parts:
+                ok = ok and self._write(ancestor / "cgroup.subtree_control", controllers)
+                ancestor = ancestor / part
+
+        if ok and self.cpu_weight is not None:
+            ok = self._write(path / "cpu.weight", str(self.cpu_weight))
+        if ok and self.io_weight is not None:
+            ok = self._write(path / "io.weight", f"default {self.io_weight}")
+        if ok:
+            self.__cgroup_path = path
+        return ok
+
+    @contextmanager
+    def window(self):
+        """ Throttle the application cgroups while the command runs, and restore their CPU limit afterwards. """
+        restore = {}
+        for cgroup in self.throttle_cgroups:
+            cpu_max = self._cgroup_path(cgroup) / "cpu.max"
+            try:
+                restore[cpu_max] = cpu_max.read_text(encoding="utf-8").strip()
+            except OSError as e:
+                logger.warning(f"{self.name}: Could not read '{cpu_max}': {e}")
+
+        # Never throttle without a way to restore the limits if the service dies while throttling
+        if restore and not _save_throttle_state(self.throttle_state_file, {str(k): v for k, v in restore.items()}):
+            logger.warning(f"{self.name}: Not throttling {self.throttle_cgroups}, their CPU limit could not be saved")
+            restore = {}
+
+        for cpu_max, previous in restore.items():
+            if self._write(cpu_max, self.throttle_cpu_max):
+                logger.debug(f"{self.name}: Throttled '{cpu_max.parent}' to '{self.throttle_cpu_max}' "
+                             f"(was '{previous}')")
+        try:
+            yield self
+        finally:
+            for cpu_max, previous in restore.items():
+                self._write(cpu_max, previous)
+                logger.debug(f"{self.name}: Restored '{cpu_max}' to '{previous}'")
+            if restore:
+                try:
+                    os.unlink(self.throttle_state_file)
+                except OSError as e:
+                    logger.warning(f"{self.name}: Could not remove '{self.throttle_state_file}': {e}")
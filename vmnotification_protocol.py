@@ -0,0 +1,195 @@
+import json
+from typing import Optional, Union
+
+from vmnotification_exception import VMNotificationException, VMNotificationProtocolException
+
+VMTOOLSD_ARGV = ("vmtoolsd", "--cmd")
+
+EVENT_TYPE_START = "start"
+EVENT_TYPE_TIMEOUT_CHANGE = "timeout-change"
+EVENT_TYPE_END = "end"
+
+# 3000-01-01, converted by datetime and time_t without overflow in any timezone
+MAX_EPOCH_SECONDS = 32503680000
+
+
+class Event(object):
+    """ An event returned by 'vm-operation-notification.check-for-event'. """
+    __slots__ = ("operation_id", "raw")
+    event_type = None
+
+    def __init__(self, operation_id, raw: Optional[dict] = None):
+        self.operation_id = operation_id
+        self.raw = raw
+
+    def encode(self) -> dict:
+        return {"result": True, "eventType": self.event_type, "operationId": self.operation_id}
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={getattr(self, k)!r}" for k in self._fields())
+        return f"{type(self).__name__}({fields})"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, k) == getattr(other, k) for k in self._fields())
+
+    @classmethod
+    def _fields(cls) -> list:
+        fields = []
+        for klass in reversed(cls.__mro__):
+            fields.extend(k for k in getattr(klass, "__slots__", ()) if k != "raw")
+        return fields
+
+
+class StartEvent(Event):
+    __slots__ = ("notification_timeout", "event_time")
+    event_type = EVENT_TYPE_START
+
+    def __init__(self, operation_id, notification_timeout: int, event_time: float, raw: Optional[dict] = None):
+        super().__init__(operation_id, raw)
+        self.notification_timeout = notification_timeout
+        self.event_time = event_time
+
+    @property
+    def deadline(self) -> float:
+        """ Epoch after which the host proceeds with the vMotion without our ack. """
+        return self.event_time + self.notification_timeout
+
+    def encode(self) -> dict:
+        reply = super().encode()
+        reply["notificationTimeoutInSec"] = self.notification_timeout
+        reply["eventGenTimeInSec"] = self.event_time
+        return reply
+
+
+class TimeoutChangeEvent(Event):
+    __slots__ = ("new_notification_timeout",)
+    event_type = EVENT_TYPE_TIMEOUT_CHANGE
+
+    def __init__(self, operation_id, new_notification_timeout: int, raw: Optional[dict] = None):
+        super().__init__(operation_id, raw)
+        self.new_notification_timeout = new_notification_timeout
+
+    def encode(self) -> dict:
+        reply = super().encode()
+        reply["newNotificationTimeoutInSec"] = self.new_notification_timeout
+        return reply
+
+
+class EndEvent(Event):
+    __slots__ = ()
+    event_type = EVENT_TYPE_END
+
+
+class UnknownEvent(Event):
+    __slots__ = ("unknown_event_type",)
+
+    def __init__(self, operation_id, unknown_event_type: str, raw: Optional[dict] = None):
+        super().__init__(operation_id, raw)
+        self.unknown_event_type = unknown_event_type
+
+    def encode(self) -> dict:
+        return {"result": True, "eventType": self.unknown_event_type, "operationId": self.operation_id}
+
+
+def _field(reply: dict, name: str, types: tuple, event_type: str):
+    value = reply.get(name)
+    # bool is a subclass of int, but never a valid value
+    if value is None or isinstance(value, bool) or not isinstance(value, types):
+        raise VMNotificationProtocolException(f"Invalid '{event_type}' event, "
+                                              f"'{name}' is missing or invalid: {value!r}")
+    return value
+
+
+def _epoch_field(reply: dict, name: str, event_type: str) -> float:
+    value = _field(reply, name, (int, float), event_type)
+    # json.loads accepts NaN, Infinity and integers of any size, NaN fails every comparison
+    if not 0 <= value <= MAX_EPOCH_SECONDS:
+        raise VMNotificationProtocolException(f"Invalid '{event_type}' event, '{name}' is out of range: {value!r}")
+    return value
+
+
+def _timeout_field(reply: dict, name: str, event_type: str) -> float:
+    value = _field(reply, name, (int, float), event_type)
+    if not 0 < value <= MAX_EPOCH_SECONDS:
+        raise VMNotificationProtocolException(f"Invalid '{event_type}' event, '{name}' is out of range: {value!r}")
+    return value
+
+
+def decode_reply(data: Union[bytes, str]) -> dict:
+    """
+    Decode the JSON reply of an RPC. A reply that cannot be decoded raises VMNotificationProtocolException, and a
+    reply reporting an error raises VMNotificationException with the error message of the host.
+    """
+    try:
+        reply = json.loads(data)
+    except ValueError as e:
+        raise VMNotificationProtocolException(f"Invalid reply, not JSON ({e}): {data[:200]!r}")
+    if not isinstance(reply, dict):
+        raise VMNotificationProtocolException(f"Invalid reply, not a JSON object: {data[:200]!r}")
+    if not reply.get("result"):
+        raise VMNotificationException(reply.get("errorMessage") or f"RPC failed: {reply}")
+    return reply
+
+
+def decode_event(reply: dict) -> Optional[Event]:
+    """
+    Decode and validate the event of a 'check-for-event' reply, in a single pass. Return None when there is no
+    event, and raise VMNotificationProtocolException for an event with missing or invalid fields, including
+    times and timeouts out of range.
+    """
+    event_type = reply.get("eventType")
+    if event_type is None:
+        return None
+
+    operation_id = reply.get("operationId")
+    match event_type:
+        case "start":
+            return StartEvent(operation_id=_field(reply, "operationId", (int, str), event_type),
+                              notification_timeout=_timeout_field(reply, "notificationTimeoutInSec", event_type),
+                              event_time=_epoch_field(reply, "eventGenTimeInSec", event_type),
+                              raw=reply)
+        case "timeout-change":
+            return TimeoutChangeEvent(operation_id=_field(reply, "operationId", (int, str), event_type),
+                                      new_notification_timeout=_timeout_field(reply, "newNotificationTimeoutInSec",
+                                                                              event_type),
+                                      raw=reply)
+        case "end":
+            return EndEvent(operation_id=operation_id, raw=reply)
+        case _:
+            return UnknownEvent(operation_id=operation_id, unknown_event_type=str(event_type), raw=reply)
+
+
+def encode_request(rpc_name: str, params: Optional[dict] = None) -> list:
+    """ Return the vmtoolsd command line of an RPC. """
+    param = json.dumps(params) if params is not None else ""
+    return [*VMTOOLSD_ARGV, f"{rpc_name} {param}"]
+
+
+def encode_reply(result: bool = True, error_message: Optional[str] = None, event: Optional[Event] = None,
+                 **fields) -> str:
+    """ Encode an RPC reply as the host does. Used to simulate the host. """
+    reply = event.encode() if event is not None else {"result": result}
+    if error_message is not None:
+        reply["result"] = False
+        reply["errorMessage"] = error_message
+    reply.update(fields)
+    return json.dumps(reply)
+
+
+class RequestCache(object):
+    """
+    Command lines of the RPCs sent with every poll, encoded once per token rather than on every call.
+    """
+
+    def __init__(self):
+        self.__token = None
+        self.__requests = {}
+
+    def get(self, rpc_name: str, token: str) -> list:
+        if token != self.__token:
+            self.__token = token
+            self.__requests = {}
+        argv = self.__requests.get(rpc_name)
+        if argv is None:
+            argv = self.__requests[rpc_name] = encode_request(rpc_name, {"uniqueToken": token})
+        return argv
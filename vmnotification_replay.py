@@ -0,0 +1,235 @@
+import json
+import logging
+import sys
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+from vmnotification_service import VMNotificationService
+from vmnotification_transcript import RPC_PREFIX, VirtualClock, load_transcript
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REPLY = '{"result": true}'
+DEFAULT_REGISTER_REPLY = '{"result": true, "uniqueToken": "<token>"}'
+
+
+class ReplayService(VMNotificationService):
+    """
+    The service, with the host replaced by a recorded transcript and the hooks by their recorded durations, on a
+    virtual clock.
+
+    Events are returned by the first poll at or after the time they were recorded (within half a poll interval),
+    so a slower hook delays them as it would on the host. The other RPCs get their recorded replies in order.
+    Each poll without an event takes the recorded poll period, so the virtual clock does not drift from the
+    recording over long idle runs. The replay stops once the transcript is exhausted.
+
+    The resulting timeline lists the events received, the hooks and the RPCs of the service, with their virtual
+    time since the start of the transcript, and a 'crash' entry if the service stopped on an error.
+    """
+
+    def __init__(self, header: dict, entries: list, clock: VirtualClock, token_file: str,
+                 hook_durations: Optional[dict] = None):
+        super().__init__(pre_vmotion_cmd=header.get("pre_vmotion_cmd", "true"),
+                         post_vmotion_cmd=header.get("post_vmotion_cmd", "true"),
+                         token_file=token_file,
+                         app_name=header.get("app_name", "replay"),
+                         check_interval_seconds=header.get("check_interval_seconds", 1),
+                         token_file_create=False,
+                         clock=clock)
+        self.timeline = []
+        self.hook_durations = hook_durations or {}
+        self.__events = deque(e for e in entries if e.get("rpc") == "check-for-event" and "n" not in e)
+        self.__idle = deque(e for e in entries if "n" in e)
+        self.__replies = {}
+        for e in entries:
+            if "rpc" in e and e["rpc"] != "check-for-event":
+                self.__replies.setdefault(e["rpc"], deque()).append(e)
+        self.__hooks = {}
+        for e in entries:
+            if "hook" in e and not e.get("rehearsal"):
+                self.__hooks.setdefault(e["hook"], deque()).append(e)
+        self.__end = max((e.get("until", e["t"]) for e in entries), default=0.0)
+        self.__operations = {}
+
+    def _record(self, t: float, action: str, **fields):
+        self.timeline.append({"t": round(t, 3), "action": action, **fields})
+
+    def _crashed(self, error: Exception):
+        self._record(self.clock.monotonic(), "crash", error=type(error).__name__, message=str(error))
+
+    def _idle_poll_seconds(self, now: float) -> float:
+        """ Time taken by a poll without an event, on top of the poll interval, from the recorded idle runs. """
+        while len(self.__idle) > 1 and self.__idle[1]["t"] <= now:
+            self.__idle.popleft()
+        if not self.__idle:
+            return 0.0
+        run = self.__idle[0]
+        if "p" in run:
+            return max(0.0, run["p"] - self.check_interval_seconds)
+        return run.get("d", 0.0)
+
+    def _event(self, now: float, reply_text: str):
+        try:
+            reply = json.loads(reply_text)
+            event_type = reply["eventType"]
+        except (ValueError, TypeError, KeyError):
+            self._record(now, "invalid_reply", reply=reply_text)
+            return
+        op_id = reply.get("operationId")
+        self._record(now, "event", event_type=event_type, operation_id=op_id)
+        match event_type:
+            case "start":
+                self.__operations[op_id] = {"received": now,
+                                            "event_time": reply.get("eventGenTimeInSec"),
+                                            "timeout": reply.get("notificationTimeoutInSec")}
+            case "timeout-change":
+                if op_id in self.__operations:
+                    self.__operations[op_id]["timeout"] = reply.get("newNotificationTimeoutInSec")
+
+    def _vmtoolsd(self, argv: list) -> bytes:
+        rpc_name, _, param = argv[-1].partition(" ")
+        rpc = rpc_name.removeprefix(RPC_PREFIX)
+        now = self.clock.monotonic()
+
+        if rpc == "check-for-event":
+            if self.__events and self.__events[0]["t"] <= now + self.check_interval_seconds / 2:
+                entry = self.__events.popleft()
+                reply, duration = entry["reply"], entry.get("d", 0.0)
+                self._event(now, reply)
+            else:
+                if not self.__events and now + self.check_interval_seconds / 2 >= self.__end:
+                    self.stop()
+                reply, duration = DEFAULT_REPLY, self._idle_poll_seconds(now)
+        else:
+            replies = self.__replies.get(rpc)
+            entry = replies.popleft() if replies else None
+            if entry is not None:
+                reply, duration = entry["reply"], entry.get("d", 0.0)
+            else:
+                reply, duration = DEFAULT_REGISTER_REPLY if rpc == "register" else DEFAULT_REPLY, 0.0
+
+            fields = {}
+            if rpc == "ack-event":
+                op_id = json.loads(param).get("operationId")
+                fields["operation_id"] = op_id
+                operation = self.__operations.get(op_id)
+                if operation is not None:
+                    fields["since_event_seconds"] = round(now - operation["received"], 3)
+                    if isinstance(operation["event_time"], (int, float)) and isinstance(operation["timeout"], (int, float)):
+                        deadline = operation["event_time"] + operation["timeout"]
+                        fields["margin_seconds"] = round(deadline - self.clock.time(), 3)
+            self._record(now, rpc, **fields)
+
+        self.clock.advance(duration)
+        return reply.encode("utf-8")
+
+    def run_hook(self, name: str, cmd: str, cmd_split: list, policy) -> float:
+        recorded = self.__hooks.get(name)
+        entry = recorded.popleft() if recorded else None
+        if name in self.hook_durations:
+            duration = self.hook_durations[name]
+        else:
+            duration = entry["d"] if entry is not None else 0.0
+        self._record(self.clock.monotonic(), name, duration_seconds=round(duration, 3))
+        self.clock.advance(duration)
+        return duration
+
+
+def compare_timelines(timeline: list, expected: list, tolerance: float) -> list:
+    """
+    Compare a replay timeline to the expected one, and return the differences. Only the fields of the expected
+    entries are compared, times within 'tolerance' seconds.
+    """
+    differences = []
+    for i, want in enumerate(expected):
+        if i >= len(timeline):
+            differences.append(f"#{i}: missing, expected {want}")
+            continue
+        got = timeline[i]
+        for key, value in want.items():
+            if key in ("t", "since_event_seconds", "margin_seconds", "duration_seconds") \
+                    and isinstance(value, (int, float)) and isinstance(got.get(key), (int, float)):
+                if abs(got[key] - value) > tolerance:
+                    differences.append(f"#{i} {got['action']}: {key} is {got[key]}, expected {value}")
+            elif got.get(key) != value:
+                differences.append(f"#{i} {got.get('action')}: {key} is {got.get(key)!r}, expected {value!r}")
+    for i in range(len(expected), len(timeline)):
+        differences.append(f"#{i}: unexpected {timeline[i]}")
+    return differences
+
+
+def replay(transcript_file: str, session: int = -1, speed: float = 0,
+           hook_durations: Optional[dict] = None) -> list:
+    """ Replay a session of a transcript, and return the resulting timeline. """
+    import tempfile
+
+    sessions = load_transcript(transcript_file)
+    if not sessions:
+        raise ValueError(f"No session in transcript '{transcript_file}'")
+    header, entries = sessions[session]
+    clock = VirtualClock(start_time=header["start_time"], speed=speed)
+    with tempfile.TemporaryDirectory() as tmp:
+        service = ReplayService(header, entries, clock,
+                                token_file=str(Path(tmp) / "token_file"),
+                                hook_durations=hook_durations)
+        service.run(on_error=service._crashed)
+    return service.timeline
+
+
+def main(argv: list) -> int:
+    """ 'vmnotification replay' command. """
+    import argparse
+    import contextlib
+
+    parser = argparse.ArgumentParser(prog='vmnotification replay',
+                                     description='Replay a recorded RPC transcript through the service, '
+                                                 'on a virtual clock')
+    parser.add_argument('transcript', type=str)
+    parser.add_argument('--session', type=int, default=-1,
+                        help="Session of the transcript to replay, one per service start (default: the last one)")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="Virtual seconds per real second (default: 0, as fast as possible)")
+    parser.add_argument('--hook-duration', type=str, action='append', default=[], metavar='HOOK=SECONDS',
+                        help="Replace the recorded duration of a hook, e.g. pre_vmotion=45")
+    parser.add_argument('--expect', type=str, help="Expected timeline (JSON), the replay fails on a difference")
+    parser.add_argument('--tolerance', type=float, default=0.001, help="Tolerance on times in seconds")
+    parser.add_argument('--write-timeline', type=str, help="Save the timeline (JSON), e.g. as an expected timeline")
+    parser.add_argument('--verbose', action='store_true', help="Log the service at DEBUG level")
+    args = parser.parse_args(argv)
+
+    hook_durations = {}
+    for value in args.hook_duration:
+        name, sep, seconds = value.partition("=")
+        try:
+            hook_durations[name] = float(seconds)
+        except ValueError:
+            parser.error(f"invalid --hook-duration '{value}', expected HOOK=SECONDS")
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format='%(name)s - %(levelname)s - %(message)s')
+
+    # Keep stdout for the timeline
+    with contextlib.redirect_stdout(sys.stderr):
+        timeline = replay(args.transcript, session=args.session, speed=args.speed, hook_durations=hook_durations)
+
+    for entry in timeline:
+        print(json.dumps(entry))
+
+    crashes = [entry for entry in timeline if entry["action"] == "crash"]
+    for crash in crashes:
+        print(f"Service stopped on an error at {crash['t']}s: {crash['message']}", file=sys.stderr)
+
+    if args.write_timeline:
+        with open(args.write_timeline, mode='w', encoding="utf-8") as f:
+            json.dump(timeline, f, indent=2)
+
+    if args.expect:
+        with open(args.expect, encoding="utf-8") as f:
+            expected = json.load(f)
+        differences = compare_timelines(timeline, expected, args.tolerance)
+        for difference in differences:
+            print(f"Timeline differs: {difference}", file=sys.stderr)
+        if differences:
+            return 1
+    return 1 if crashes else 0
@@ -1,22 +1,40 @@
 import datetime
-import json
 import logging
+import os
+import queue
 import re
 import shlex
 import signal
+import threading
+from contextlib import nullcontext
 from pathlib import Path
 from subprocess import Popen, PIPE, STDOUT
-from time import sleep
-
-from vmnotification_exception import VMNotificationException
+from typing import TYPE_CHECKING, Optional
+
+from vmnotification_exception import VMNotificationException, VMNotificationProtocolException
+from vmnotification_handoff import load_state, reexec
+from vmnotification_protocol import (EndEvent, Event, RequestCache, StartEvent, TimeoutChangeEvent, UnknownEvent,
+                                     decode_event, decode_reply, encode_request)
+from vmnotification_systemd import Watchdog, notify
+from vmnotification_tracing import SPAN_KIND_CLIENT, Tracer
+from vmnotification_transcript import Clock
+
+# Only what registering needs is imported with the service, the optional features are imported once registered
+if TYPE_CHECKING:
+    from vmnotification_coordination import DrainCoordinator
+    from vmnotification_hook_policy import HookPolicy
+    from vmnotification_transcript import TranscriptRecorder
+    from vmnotification_warmup import Warmup
 
 logger = logging.getLogger(__name__)
 logger_vmotion = logging.getLogger('vmotion')
 logger_timeout = logging.getLogger('timeout')
 
+# Longest the polling thread waits for a cancelled warm-up to stop, e.g. when the next vMotion starts
+WARMUP_CANCEL_WAIT_SECONDS = 5.0
+
 
 class VMNotificationService(object):
-    VMTOOLSD_CMD = "vmtoolsd --cmd "
     RPC_REGISTER_CMD = "vm-operation-notification.register"
     RPC_UNREGISTER_CMD = "vm-operation-notification.unregister"
     RPC_CHECK_EVENT_CMD = "vm-operation-notification.check-for-event"
@@ -31,6 +49,13 @@ class VMNotificationService(object):
                  check_interval_seconds: int = 1,
                  token_file_create: bool = True,
                  token_obfuscate_logfile: bool = False,
+                 tracer: Tracer = None,
+                 coordinator: "DrainCoordinator" = None,
+                 pre_vmotion_policy: "HookPolicy" = None,
+                 post_vmotion_policy: "HookPolicy" = None,
+                 warmup: "Warmup" = None,
+                 clock: Clock = None,
+                 transcript: "TranscriptRecorder" = None,
                  ):
         logger.debug(
             f"__init__: ["
@@ -50,9 +75,35 @@ class VMNotificationService(object):
         self.check_interval_seconds = check_interval_seconds
         self.token_file_create = token_file_create
         self.token_obfuscate_logfile = token_obfuscate_logfile
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.coordinator = coordinator
+        self.pre_vmotion_policy = pre_vmotion_policy
+        self.post_vmotion_policy = post_vmotion_policy
+        self.warmup = warmup
+        self.clock = clock if clock is not None else Clock()
+        self.transcript = transcript
+        self.watchdog = Watchdog()
         self.__token = None
         self.__run = True
+        self.__upgrade = False
         self.__ran_pre_cmd = False
+        self.__trace = None
+        self.__migration_span = None
+        self.__warmup_span = None
+        self.__warmup_operation = None
+        self.__last_warmup = None
+        self.__requests = RequestCache()
+        self.__rpc_lock = threading.Lock()
+        self.__loop_calls = queue.SimpleQueue()
+        self.__started = self.clock.time()
+        self.__phase = "starting"
+        self.__operation = None
+        self.__last_event = None
+        self.__polls = 0
+        self.__last_poll = None
+        self.__hook_durations = {}
+        self.__paused = False
+        self.__rehearsal = False
         logger.debug(f"__init__: pre_vmotion_cmd_split: {self.pre_vmotion_cmd_split}")
         logger.debug(f"__init__: post_vmotion_cmd_split: {self.post_vmotion_cmd_split}")
 
@@ -117,43 +168,298 @@ class VMNotificationService(object):
             self._debug(f"delete_token: No token file to delete at {self.token_file}")
 
     def run_rpc(self, rpc_name: str, params: dict):
-        from shlex import quote
-
-        # handle none param dict
-        param = ""
-        if params is not None:
-            param = json.dumps(params)
-        cmd = self.VMTOOLSD_CMD + quote(rpc_name + " " + param)
-
-        self._debug(f"run_rpc: Running cmd : {cmd}")
-
-        output = Popen(shlex.split(cmd), stdout=PIPE, stderr=STDOUT)
-        stdout = output.communicate()
-        reply = json.loads(stdout[0])
-        if not reply.get("result"):
-            error_msg = reply.get('errorMessage')
-            self._critical(f"run_rpc: {error_msg}")
-            raise VMNotificationException(error_msg)
-
-        return reply
+        return self.run_rpc_argv(rpc_name, encode_request(rpc_name, params))
+
+    def run_rpc_argv(self, rpc_name: str, argv: list) -> dict:
+        """ Run an RPC from its already encoded command line, and return the decoded reply. """
+        if logger.isEnabledFor(logging.DEBUG):
+            self._debug(f"run_rpc: Running cmd : {shlex.join(argv)}")
+
+        with self.tracer.start_span(rpc_name, kind=SPAN_KIND_CLIENT, attributes={"rpc.method": rpc_name}) as span:
+            # The control socket runs RPCs from another thread, never concurrently with the polling loop
+            with self.__rpc_lock:
+                start = self.clock.monotonic()
+                stdout = self._vmtoolsd(argv)
+                if self.transcript is not None:
+                    self.transcript.record_rpc(rpc_name, argv, start, self.clock.monotonic() - start, stdout)
+            try:
+                return decode_reply(stdout)
+            except VMNotificationProtocolException as e:
+                self._error(f"run_rpc: {e}")
+                span.set_error(str(e))
+                raise
+            except VMNotificationException as e:
+                self._critical(f"run_rpc: {e}")
+                span.set_error(str(e))
+                raise
+
+    def _vmtoolsd(self, argv: list) -> bytes:
+        """ Run an RPC command line and return its raw reply. """
+        output = Popen(argv, stdout=PIPE, stderr=STDOUT)
+        return output.communicate()[0]
+
+    def check_for_event(self) -> Optional[Event]:
+        argv = self.__requests.get(self.RPC_CHECK_EVENT_CMD, self.__token)
+        return decode_event(self.run_rpc_argv(self.RPC_CHECK_EVENT_CMD, argv))
+
+    def list_registrations(self) -> dict:
+        """ Applications registered for notifications on this VM, as reported by the host. """
+        return self.run_rpc(self.RPC_LIST_CMD, None)
+
+    def run_hook(self, name: str, cmd: str, cmd_split: list, policy: Optional["HookPolicy"]) -> float:
+        """ Run a pre or post vMotion command with its execution policy, and return how long it took. """
+        if policy is None:
+            from vmnotification_hook_policy import HookPolicy
+
+            policy = HookPolicy(name)
+        self._debug(f"run_{name}: Running cmd : '{cmd_split}' (policy: {policy.describe()})")
+        with self.tracer.start_span(f"{name}_cmd", attributes={"process.command_line": cmd,
+                                                               "hook.policy": policy.describe()}) as span:
+            with policy.window():
+                start = self.clock.monotonic()
+                output = Popen(policy.command(cmd_split), stdout=PIPE, stderr=STDOUT)
+                for line in output.stdout:
+                    line_striped = line.rstrip(b"\n")
+                    self._debug(f"run_{name}: '{line_striped}'")
+                output.wait()
+                duration = self.clock.monotonic() - start
+            self.__hook_durations[name] = {"duration_seconds": round(duration, 3),
+                                           "exit_code": output.returncode,
+                                           "time": self.clock.time(),
+                                           "rehearsal": self.__rehearsal}
+            if self.transcript is not None:
+                self.transcript.record_hook(name, start, duration, output.returncode, rehearsal=self.__rehearsal)
+            span.set_attribute("process.exit_code", output.returncode)
+            span.set_attribute("hook.duration_seconds", duration)
+
+            msg = f"{name} command completed in {duration:.3f} seconds (policy: {policy.describe()})"
+            if policy.baseline_seconds is not None:
+                gained = policy.baseline_seconds - duration
+                span.set_attribute("hook.time_gained_seconds", gained)
+                msg += f", {gained:.3f} seconds gained over the {policy.baseline_seconds} seconds baseline"
+            logger_vmotion.debug(msg)
+
+        self._debug(f"run_{name}: Command completed.")
+        return duration
 
     def run_pre_vmotion(self):
-        self._debug(f"run_pre_vmotion: Running cmd : '{self.pre_vmotion_cmd_split}'")
-        output = Popen(self.pre_vmotion_cmd_split, stdout=PIPE, stderr=STDOUT)
-        for line in output.stdout:
-            line_striped = line.rstrip(b"\n")
-            self._debug(f"run_pre_vmotion: '{line_striped}'")
-        output.wait()
-        self._debug(f"run_pre_vmotion: Command completed.")
+        return self.run_hook("pre_vmotion", self.pre_vmotion_cmd, self.pre_vmotion_cmd_split, self.pre_vmotion_policy)
 
     def run_post_vmotion(self):
-        self._debug(f"run_post_vmotion: Running cmd : '{self.post_vmotion_cmd_split}'")
-        output = Popen(self.post_vmotion_cmd_split, stdout=PIPE, stderr=STDOUT)
-        for line in output.stdout:
-            line_striped = line.rstrip(b"\n")
-            self._debug(f"run_post_vmotion: '{line_striped}'")
-        output.wait()
-        self._debug(f"run_post_vmotion: Command completed.")
+        return self.run_hook("post_vmotion", self.post_vmotion_cmd, self.post_vmotion_cmd_split, self.post_vmotion_policy)
+
+    def start_warmup(self, op_id: str) -> bool:
+        """
+        Start warming the application up after the post-vmotion command, readiness is signalled by the warm-up.
+        The warm-up runs on a background thread, so that the next vMotion is noticed while it runs. The trace of
+        the operation is ended once the warm-up completed, see check_warmup().
+        """
+        if self.warmup is None:
+            return False
+        if self.warmup.running:
+            self._warning(f"start_warmup: The previous warm-up is still stopping, warm-up skipped")
+            return False
+        self.__phase = "warming"
+        self.__warmup_span = self.tracer.start_span("warmup", parent=self.__trace)
+        self.__warmup_operation = op_id
+        self.warmup.start(span=self.__warmup_span, operation_id=op_id)
+        return True
+
+    def check_warmup(self, cancel: bool = False) -> Optional[dict]:
+        """ Collect the result of the warm-up once it completed, or cancel it, e.g. when the next vMotion starts. """
+        if self.__warmup_span is None:
+            return None
+        if cancel:
+            self.warmup.cancel()
+        result = self.warmup.result(timeout=WARMUP_CANCEL_WAIT_SECONDS if cancel else 0)
+        if result is None:
+            if not cancel:
+                return None
+            # Never block the polling thread on a warm-up that does not stop, its thread is left behind
+            self._warning(f"check_warmup: The warm-up did not stop within {WARMUP_CANCEL_WAIT_SECONDS} seconds, "
+                          f"abandoned")
+            result = {"operation_id": self.__warmup_operation, "time": self.clock.time(), "ready_reason": "abandoned"}
+
+        if result["ready_reason"] not in ("target", "deadline"):
+            self.__warmup_span.set_error(f"warm-up {result['ready_reason']}")
+        self.__warmup_span.end()
+        self.__warmup_span = None
+        self.__last_warmup = result
+        self._debug(f"check_warmup: Warm-up of migration id '{result['operation_id']}' complete after "
+                    f"{result.get('duration_seconds')} seconds ({result['ready_reason']}).")
+        self.end_trace()
+        if self.__phase == "warming":
+            self.__phase = "idle"
+        return result
+
+    def rehearse_drain(self, lease_timeout_seconds: float = 60) -> dict:
+        """
+        Run the pre and post vMotion commands, and the warm-up, as on a vMotion but without an event from the
+        host, and return how long each took. With drain coordination, a drain lease is held as for a vMotion.
+        """
+        if self.__operation is not None or self.__ran_pre_cmd:
+            raise VMNotificationException(f"Cannot rehearse a drain, a vMotion operation is in progress")
+        self.check_warmup(cancel=True)
+
+        self._info(f"rehearse_drain: Rehearsing a drain of '{self.app_name}'")
+        logger_vmotion.debug(f"{'-' * 60}")
+        logger_vmotion.debug(f"drain rehearsal starting.")
+        self.__rehearsal = True
+        self.__trace = self.tracer.start_trace("drain_rehearsal", attributes={"vmotion.app_name": self.app_name})
+        result = {}
+        start = self.clock.monotonic()
+        error = None
+        warming = False
+        try:
+            if not self.acquire_drain_lease(self.clock.time() + lease_timeout_seconds):
+                raise VMNotificationException(f"no drain lease available within {lease_timeout_seconds} seconds")
+
+            self.__phase = "draining"
+            with self.tracer.start_span("pre_vmotion", parent=self.__trace), self.watchdog.busy():
+                result["pre_vmotion_seconds"] = round(self.run_pre_vmotion(), 3)
+
+            self.__phase = "restoring"
+            with self.tracer.start_span("post_vmotion", parent=self.__trace), self.watchdog.busy():
+                result["post_vmotion_seconds"] = round(self.run_post_vmotion(), 3)
+
+            self.release_drain_lease()
+            result["total_seconds"] = round(self.clock.monotonic() - start, 3)
+            # Reported by status once complete
+            warming = self.start_warmup("rehearsal")
+            result["warmup_started"] = warming
+            return result
+        except VMNotificationException as e:
+            error = str(e)
+            raise
+        finally:
+            self.release_drain_lease()
+            if not warming:
+                self.end_trace(error=error)
+                self.__phase = "idle"
+            self.__rehearsal = False
+            logger_vmotion.debug(f"drain rehearsal complete: {error or result}.")
+
+    def call_in_loop(self, func, *args):
+        """
+        Run 'func' from the polling loop, between two polls, and return its result. Called from another thread,
+        so that hooks never run concurrently with the handling of a vMotion.
+        """
+        done = threading.Event()
+        outcome = {}
+        self.__loop_calls.put((func, args, done, outcome))
+        done.wait()
+        if "error" in outcome:
+            raise outcome["error"]
+        return outcome["result"]
+
+    def run_loop_calls(self, error: Optional[Exception] = None):
+        """ Run the calls queued by call_in_loop(), or fail them with 'error'. """
+        while True:
+            try:
+                func, args, done, outcome = self.__loop_calls.get_nowait()
+            except queue.Empty:
+                return
+            if error is not None:
+                outcome["error"] = error
+            else:
+                try:
+                    outcome["result"] = func(*args)
+                except Exception as e:
+                    outcome["error"] = e
+            done.set()
+
+    def pause(self):
+        """ Acknowledge vMotion start events right away, without draining, until resumed. """
+        self._warning(f"pause: Paused, vMotions proceed without running the pre and post vmotion commands")
+        self.__paused = True
+
+    def resume(self):
+        self._info(f"resume: Resumed")
+        self.__paused = False
+
+    def status(self) -> dict:
+        """ State of the service, for the control socket. """
+        return {
+            "app_name": self.app_name,
+            "pid": os.getpid(),
+            "registered": self.__token is not None,
+            "uptime_seconds": round(self.clock.time() - self.__started, 3),
+            "phase": self.__phase,
+            "rehearsal": self.__rehearsal,
+            "paused": self.__paused,
+            "operation": dict(self.__operation) if self.__operation is not None else None,
+            "last_event": self.__last_event,
+            "polls": self.__polls,
+            "last_poll": self.__last_poll,
+            "hooks": dict(self.__hook_durations),
+            "last_warmup": self.__last_warmup,
+            "drain_lease": self.coordinator.holding if self.coordinator is not None else None,
+        }
+
+    def acquire_drain_lease(self, deadline: float) -> bool:
+        """
+        Wait for one of the drain leases of the application group before draining. Without a coordinator, every
+        instance drains independently.
+        """
+        if self.coordinator is None:
+            return True
+        self.__phase = "waiting_for_lease"
+        logger_vmotion.debug(f"waiting for a drain lease for '{self.coordinator.group}'.")
+        with self.tracer.start_span("drain_lease", parent=self.__trace,
+                                    attributes={"vmotion.drain_group": self.coordinator.group,
+                                                "vmotion.max_concurrent_drains": self.coordinator.max_concurrent_drains}) as span:
+            with self.watchdog.busy():
+                acquired = self.coordinator.acquire(deadline)
+            span.set_attribute("vmotion.drain_lease_acquired", acquired)
+        logger_vmotion.debug(f"drain lease {'acquired' if acquired else 'not available'}.")
+        return acquired
+
+    def release_drain_lease(self):
+        if self.coordinator is None:
+            return
+        self.coordinator.release()
+
+    def start_trace(self, op_id: str, notification_timeout: int, event_time_epoch: int):
+        """
+        Start the trace of a vMotion operation. The host to guest notification delay is recorded as the first
+        child span, from the event generation time to the moment we received it.
+        """
+        self.end_trace(error="superseded by a new vmotion start event")
+        now_ns = self.clock.time_ns()
+        event_time_ns = int(event_time_epoch * 1e9) if event_time_epoch else now_ns
+        self.__trace = self.tracer.start_trace("vmotion",
+                                               attributes={"vmotion.operation_id": op_id,
+                                                           "vmotion.notification_timeout_seconds": notification_timeout,
+                                                           "vmotion.app_name": self.app_name},
+                                               start_time_ns=min(event_time_ns, now_ns))
+        self.tracer.start_span("event_detected", parent=self.__trace, start_time_ns=event_time_ns).end(now_ns)
+
+    def resume_trace(self, trace_id: Optional[str]):
+        """
+        Continue the trace of the vMotion operation in progress after an upgrade, under the trace id of the
+        previous process, which ended its own root span.
+        """
+        op = self.__operation
+        self.__trace = self.tracer.start_trace("vmotion",
+                                               attributes={"vmotion.operation_id": op["operation_id"],
+                                                           "vmotion.notification_timeout_seconds": op["notification_timeout"],
+                                                           "vmotion.app_name": self.app_name,
+                                                           "vmotion.resumed_after_upgrade": True},
+                                               trace_id=trace_id)
+        self.__migration_span = self.tracer.start_span("migration", parent=self.__trace,
+                                                       attributes={"vmotion.resumed_after_upgrade": True})
+
+    def end_trace(self, error: str = None):
+        if self.__migration_span is not None:
+            if error:
+                self.__migration_span.set_error(error)
+            self.__migration_span.end()
+            self.__migration_span = None
+        if self.__trace is not None:
+            if error:
+                self.__trace.set_error(error)
+            self.__trace.end()
+            self.__trace = None
 
     def register_for_notification(self):
         """
@@ -204,49 +510,86 @@ class VMNotificationService(object):
         self._debug(f"ack_event: Acknowledged.")
 
     def check_for_events(self):
-        self.__run = True
-
         # A bit ugly, but workaround for obfuscation
         params = {"uniqueToken": self.__token}
         self._debug(f"check_for_events: params: '{params}'.")
         params = {"uniqueToken": self.__token}
 
         while self.__run:
-            reply = self.run_rpc(self.RPC_CHECK_EVENT_CMD, params)
-            event_type = reply.get("eventType", None)
+            try:
+                event = self.check_for_event()
+            except VMNotificationProtocolException as e:
+                # The host proceeds with the vMotion once the notification timeout expires
+                self._error(f"check_for_events: Ignoring invalid reply: {e}")
+                event = None
+            self.__polls += 1
+            self.__last_poll = self.clock.time()
+            if event is not None:
+                self.__last_event = {"time": self.__last_poll, "event": event.raw}
+
+            if isinstance(event, StartEvent):
+                # The application is about to be drained again
+                self.check_warmup(cancel=True)
 
-            if event_type == "start":
                 logger_vmotion.debug(f"{'-' * 60}")
-                logger_vmotion.debug(f"vmotion start event: {reply}")
-                op_id = reply.get("operationId")
-                notification_timeout = reply.get("notificationTimeoutInSec")
-                event_time_epoch = reply.get("eventGenTimeInSec")
+                logger_vmotion.debug(f"vmotion start event: {event.raw}")
+                op_id = event.operation_id
+                notification_timeout = event.notification_timeout
+                event_time_epoch = event.event_time
                 self._debug(f"check_for_events: vmotion notification with operationId: '{op_id}'")
                 self._debug(f"check_for_events: notification timeout: '{notification_timeout}' seconds")
                 self._debug(f"check_for_events: event time: '{datetime.datetime.fromtimestamp(event_time_epoch)}'")
 
                 print(f"vmotion start with operation ID '{op_id}' and timeout of {notification_timeout} seconds.")
 
-                event_time = datetime.datetime.fromtimestamp(event_time_epoch)
-                time_now = datetime.datetime.now()
+                self.start_trace(op_id, notification_timeout, event_time_epoch)
+                self.__operation = {"operation_id": op_id,
+                                    "notification_timeout": notification_timeout,
+                                    "event_time": event_time_epoch,
+                                    "deadline": event.deadline}
 
-                if time_now < event_time + datetime.timedelta(0, notification_timeout):
+                if self.clock.time() >= event.deadline:
+                    # Stale event
+                    self._warning(f"stale event - ignoring vmotion event with {op_id}")
+                    self.end_trace(error="stale event")
+                    self.__operation = None
+
+                elif self.__paused:
+                    # Paused from the control socket, let the host proceed right away
+                    self._warning(f"paused - acknowledging vmotion event with {op_id} without draining")
+                    with self.tracer.start_span("ack", parent=self.__trace):
+                        self.ack_event(op_id)
+                    self.__phase = "migrating"
+                    self.__migration_span = self.tracer.start_span("migration", parent=self.__trace)
+
+                elif not self.acquire_drain_lease(event.deadline):
+                    # Other members of the application are draining, let the host proceed on timeout
+                    self._warning(f"no drain lease available - not draining for vmotion event with {op_id}")
+                    self.end_trace(error="no drain lease available within the notification timeout")
+                    self.__operation = None
+                    self.__phase = "idle"
+
+                else:
                     # Invoke PRE vMotion operation
+                    self.__phase = "draining"
                     logger_vmotion.debug(f"pre-vmotion command starting: '{self.pre_vmotion_cmd}'")
-                    self.run_pre_vmotion()
+                    with self.tracer.start_span("pre_vmotion", parent=self.__trace), self.watchdog.busy():
+                        self.run_pre_vmotion()
                     self.__ran_pre_cmd = True
                     logger_vmotion.debug(f"pre-vmotion command complete.")
-                
+
                     # Ack start event
                     logger_vmotion.debug(f"acknowledging vmotion operation.")
-                    self.ack_event(op_id)
-                else:
-                    # Stale event
-                    self._warning(f"stale event - ignoring vmotion event with {op_id}")
+                    with self.tracer.start_span("ack", parent=self.__trace):
+                        self.ack_event(op_id)
+
+                    # The migration itself runs between our ack and the end event
+                    self.__phase = "migrating"
+                    self.__migration_span = self.tracer.start_span("migration", parent=self.__trace)
 
-            elif event_type == "timeout-change":
-                op_id = reply.get("operationId")
-                notification_timeout = reply.get("newNotificationTimeoutInSec")
+            elif isinstance(event, TimeoutChangeEvent):
+                op_id = event.operation_id
+                notification_timeout = event.new_notification_timeout
                 self._warning(f"check_for_events: Notification timeout change event received.")
                 self._warning(f"check_for_events: new notification timeout: '{notification_timeout}' seconds.")
 
@@ -254,63 +597,187 @@ class VMNotificationService(object):
                 logger_timeout.warning(f"check_for_events: Notification timeout change event received.'")
                 logger_timeout.warning(f"check_for_events: new notification timeout: '{notification_timeout}' seconds.")
 
-                self.ack_event(op_id)
+                if self.__operation is not None and self.__operation["operation_id"] == op_id:
+                    self.__operation["notification_timeout"] = notification_timeout
+                    self.__operation["deadline"] = self.__operation["event_time"] + notification_timeout
+
+                with self.tracer.start_span("timeout_change", parent=self.__trace,
+                                            attributes={"vmotion.new_notification_timeout_seconds": notification_timeout}):
+                    self.ack_event(op_id)
+
+            elif isinstance(event, EndEvent):
+                logger_vmotion.debug(f"vmotion end event: {event.raw}")
+                self._debug(f"check_for_events: vMotion end notification for migration id '{event.operation_id}'.")
+                print(f"vMotion end with operation ID '{event.operation_id}'")
 
-            elif event_type == "end":
-                logger_vmotion.debug(f"vmotion end event: {reply}")
-                self._debug(f"check_for_events: vMotion end notification for migration id '{reply.get('operationId')}'.")
-                print(f"vMotion end with operation ID '{reply.get('operationId')}'")
+                if self.__migration_span is not None:
+                    self.__migration_span.end()
+                    self.__migration_span = None
 
                 # Invoke POST vMotion operation
+                restored = self.__ran_pre_cmd
                 if self.__ran_pre_cmd:
+                    self.__phase = "restoring"
                     logger_vmotion.debug(f"post-vmotion command starting: '{self.post_vmotion_cmd}'.")
-                    self.run_post_vmotion()
+                    with self.tracer.start_span("post_vmotion", parent=self.__trace), self.watchdog.busy():
+                        self.run_post_vmotion()
                     self.__ran_pre_cmd = False
                     logger_vmotion.debug(f"post-vmotion command complete.")
                 else:
                     self._warning(f"pre command not run, not running post command")
 
-            # poll interval
-            sleep(self.check_interval_seconds)
+                # The application is back, the other members of the group can drain during the warm-up
+                self.release_drain_lease()
+                self.__operation = None
+                if not (restored and self.start_warmup(event.operation_id)):
+                    self.end_trace()
+                    self.__phase = "idle"
 
-    def run(self):
+            elif isinstance(event, UnknownEvent):
+                self._warning(f"check_for_events: Ignoring unknown event type '{event.unknown_event_type}': {event.raw}")
 
-        # Setup signal handlers for SIGINT and SIGTERM
-        signal.signal(signal.SIGINT, self.stop)
-        signal.signal(signal.SIGTERM, self.stop)
+            self.check_warmup()
 
-        try:
-            # Cleanup in case a previous instance was not terminated cleanly
-            self.read_token()
-            self.unregister_for_notification()
-        except FileNotFoundError:
-            self._debug(f"run: No existing tokens to unregister.")
-        except VMNotificationException as e:
-            self._debug(f"run: {e}")
+            # Requests from the control socket, e.g. a drain rehearsal
+            self.run_loop_calls()
 
-        try:
-            # Register for notification
-            self.__token = self.register_for_notification()
+            if self.coordinator is not None:
+                self.coordinator.renew()
+
+            self.watchdog.kick()
+
+            # poll interval, the watchdog is fed in the background if it does not tolerate the interval
+            long_interval = self.watchdog.enabled and self.check_interval_seconds >= self.watchdog.interval_seconds / 2
+            with self.watchdog.busy() if long_interval else nullcontext():
+                self.clock.sleep(self.check_interval_seconds)
+
+    def handoff_state(self) -> dict:
+        """
+        State handed over to the new process on an upgrade, so it resumes polling without registering again, and
+        resumes the vMotion operation in progress.
+        """
+        trace_id = self.__trace.trace_id if self.__trace is not None else None
+        return {
+            "token": self.__token,
+            "ran_pre_cmd": self.__ran_pre_cmd,
+            "operation": self.__operation,
+            "last_event": self.__last_event,
+            "hook_durations": self.__hook_durations,
+            "trace_id": trace_id or None,
+            "paused": self.__paused,
+            "drain_lease": self.coordinator is not None and self.coordinator.holding,
+            "drain_lease_hold_until": self.coordinator.hold_until if self.coordinator is not None else None,
+        }
+
+    def restore_handoff_state(self, state: dict):
+        self.__token = state.get("token")
+        self.__ran_pre_cmd = state.get("ran_pre_cmd", False)
+        self.__operation = state.get("operation")
+        self.__last_event = state.get("last_event")
+        self.__hook_durations = state.get("hook_durations") or {}
+        self.__paused = state.get("paused", False)
+        if state.get("drain_lease") and self.coordinator is not None:
+            self.coordinator.adopt(state.get("drain_lease_hold_until"))
+        if self.__operation is not None:
+            self.resume_trace(state.get("trace_id"))
+        self._debug(f"restore_handoff_state: Resuming with token {self.__token} "
+                    f"(pre command ran: {self.__ran_pre_cmd}, operation: {self.__operation})")
+
+    def run(self, on_registered=None, on_error=None):
+        """
+        Register for notifications and poll for vMotion events until stopped. 'on_registered' is called once
+        registered, so that everything not needed to register is deferred until the service is listening.
+        'on_error' is called with the exception that stopped the service, before it cleans up.
+        """
 
-            # Write token to file
-            if self.token_file_create:
-                self.write_token()
+        # Setup signal handlers for SIGINT and SIGTERM, and SIGHUP to upgrade
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGHUP, self.upgrade)
+
+        # On an upgrade, the previous process handed over its registration
+        state = load_state()
+        if state is not None and not state.get("token"):
+            state = None
+
+        if state is None:
+            try:
+                # Cleanup in case a previous instance was not terminated cleanly
+                self.read_token()
+                self.unregister_for_notification()
+            except FileNotFoundError:
+                self._debug(f"run: No existing tokens to unregister.")
+            except VMNotificationException as e:
+                self._debug(f"run: {e}")
+
+        handoff = False
+        try:
+            if state is None:
+                # Register for notification
+                self.__token = self.register_for_notification()
+
+                # Write token to file
+                if self.token_file_create:
+                    self.write_token()
+
+            # The features attached once registered, e.g. the coordinator, are needed to resume an operation
+            if on_registered is not None:
+                on_registered()
+            if state is not None:
+                self.restore_handoff_state(state)
+            notify("READY=1")
+            self.__phase = "migrating" if self.__ran_pre_cmd or self.__operation is not None else "idle"
 
             # Check for vmotion events
             self.check_for_events()
+            handoff = self.__upgrade
 
         except VMNotificationException as e:
             self._critical(f"run: {e}")
+            if on_error is not None:
+                on_error(e)
 
         except Exception as e:
             self._critical(f"run: Unexpected exception: {e}")
+            if on_error is not None:
+                on_error(e)
 
         finally:
+            if handoff:
+                # Keep the registration, the token file and the drain lease for the new process
+                self._debug(f"run: Handing over to the new process")
+                self.check_warmup(cancel=True)
+                state = self.handoff_state()
+                # The new process continues the trace under the same trace id
+                for span in (self.__migration_span, self.__trace):
+                    if span is not None:
+                        span.add_event("upgrade")
+                        span.set_attribute("vmotion.handed_over", True)
+                self.end_trace()
+                notify("RELOADING=1")
+                if self.transcript is not None:
+                    self.transcript.close()
+                self.tracer.flush()
+                reexec(state)
+
             self._debug(f"run: Cleaning up")
+            self.__phase = "stopping"
+            self.run_loop_calls(error=VMNotificationException("service stopping"))
+            notify("STOPPING=1")
+            self.check_warmup(cancel=True)
+            self.end_trace(error="service stopped during the vmotion operation")
+            self.release_drain_lease()
             self.unregister_for_notification()
             self.delete_token()
 
     def stop(self, signum=None, frame=None):
-        signame = signal.Signals(signum).name
+        signame = signal.Signals(signum).name if signum is not None else "the service"
         self._debug(f"stop: Received stop request from {signame}")
         self.__run = False
+        if self.warmup is not None:
+            self.warmup.stop()
+
+    def upgrade(self, signum=None, frame=None):
+        self._debug(f"upgrade: Received upgrade request, re-executing after the current poll")
+        self.__upgrade = True
+        self.__run = False
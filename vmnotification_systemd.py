@@ -0,0 +1,105 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+logger = logging.getLogger(__name__)
+
+
+def notify(state: str) -> bool:
+    """
+    Send a notification to systemd (sd_notify protocol), e.g. 'READY=1'. Return False when not started by a
+    systemd unit with Type=notify.
+    """
+    address = os.environ.get("NOTIFY_SOCKET")
+    if not address:
+        return False
+
+    import socket
+
+    # Abstract namespace socket
+    if address.startswith("@"):
+        address = "\0" + address[1:]
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC) as sock:
+            sock.connect(address)
+            sock.sendall(state.encode("utf-8"))
+        return True
+    except OSError as e:
+        logger.warning(f"notify: Could not notify systemd '{state}': {e}")
+        return False
+
+
+def watchdog_interval_seconds() -> float:
+    """ Return the watchdog interval requested by systemd (WatchdogSec=), or 0 when the watchdog is disabled. """
+    usec = os.environ.get("WATCHDOG_USEC")
+    pid = os.environ.get("WATCHDOG_PID")
+    if not usec or (pid and pid != str(os.getpid())):
+        return 0
+    try:
+        return int(usec) / 1e6
+    except ValueError:
+        return 0
+
+
+class Watchdog(object):
+    """
+    Keep the systemd watchdog fed while the service is healthy.
+
+    The polling loop calls kick() on every poll. Hooks and drain lease waits legitimately block the loop for up to
+    the notification timeout, so they run inside busy(), during which a background thread feeds the watchdog.
+    """
+
+    def __init__(self):
+        self.interval_seconds = watchdog_interval_seconds()
+        self.__last = 0.0
+        self.__busy = 0
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval_seconds > 0
+
+    def kick(self):
+        if not self.enabled:
+            return
+        now = monotonic()
+        if now - self.__last >= self.interval_seconds / 2:
+            self.__last = now
+            notify("WATCHDOG=1")
+
+    @contextmanager
+    def busy(self):
+        self._enter_busy()
+        try:
+            yield self
+        finally:
+            self._exit_busy()
+
+    def _enter_busy(self):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.__busy += 1
+            if self.__thread is None:
+                self.__stop = threading.Event()
+                self.__thread = threading.Thread(target=self._feed, args=(self.__stop,), name="watchdog", daemon=True)
+                self.__thread.start()
+
+    def _exit_busy(self):
+        if not self.enabled:
+            return
+        with self.__lock:
+            self.__busy -= 1
+            if self.__busy == 0 and self.__thread is not None:
+                self.__stop.set()
+                self.__thread = None
+
+    def _feed(self, stop: threading.Event):
+        while not stop.wait(self.interval_seconds / 4):
+            self.kick()
+
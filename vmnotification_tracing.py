@@ -0,0 +1,351 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+# OTLP status codes
+STATUS_CODE_UNSET = 0
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+# Finished traces waiting for the exporter thread, dropped beyond
+EXPORT_QUEUE_SIZE = 64
+
+
+def _otlp_value(value) -> dict:
+    # bool must be tested before int, bool is a subclass of int
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: dict) -> list:
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items() if v is not None]
+
+
+class Span(object):
+    """
+    A single timed phase of an operation. Spans are created by the Tracer, and the whole trace is exported once
+    the root span is ended.
+    """
+
+    def __init__(self,
+                 tracer: "Tracer",
+                 name: str,
+                 trace_id: str,
+                 parent: Optional["Span"] = None,
+                 kind: int = SPAN_KIND_INTERNAL,
+                 attributes: Optional[dict] = None,
+                 start_time_ns: Optional[int] = None):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.kind = kind
+        self.attributes = dict(attributes) if attributes else {}
+        self.events = []
+        self.status_code = STATUS_CODE_UNSET
+        self.status_message = ""
+        self.start_time_ns = start_time_ns if start_time_ns is not None else time.time_ns()
+        self.end_time_ns = None
+
+    @property
+    def is_root(self) -> bool:
+        return self.parent is None
+
+    @property
+    def root(self) -> "Span":
+        span = self
+        while span.parent is not None:
+            span = span.parent
+        return span
+
+    @property
+    def duration_seconds(self) -> Optional[float]:
+        if self.end_time_ns is None:
+            return None
+        return (self.end_time_ns - self.start_time_ns) / 1e9
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add_event(self, name: str, attributes: Optional[dict] = None):
+        self.events.append((time.time_ns(), name, dict(attributes) if attributes else {}))
+
+    def set_error(self, message: str):
+        self.status_code = STATUS_CODE_ERROR
+        self.status_message = message
+
+    def end(self, end_time_ns: Optional[int] = None):
+        if self.end_time_ns is not None:
+            return
+        self.end_time_ns = end_time_ns if end_time_ns is not None else time.time_ns()
+        if self.status_code == STATUS_CODE_UNSET:
+            self.status_code = STATUS_CODE_OK
+        self.tracer.span_ended(self)
+
+    def __enter__(self):
+        self.tracer.push(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.tracer.pop(self)
+        if exc_val is not None:
+            self.set_error(f"{exc_type.__name__}: {exc_val}")
+        self.end()
+        return False
+
+    def otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_time_ns),
+            "endTimeUnixNano": str(self.end_time_ns),
+            "attributes": _otlp_attributes(self.attributes),
+            "events": [{"timeUnixNano": str(t), "name": n, "attributes": _otlp_attributes(a)}
+                       for t, n, a in self.events],
+            "status": {"code": self.status_code},
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        if self.status_message:
+            span["status"]["message"] = self.status_message
+        return span
+
+
+class _NoopSpan(Span):
+    """ Span returned when tracing is disabled, or when a child span is requested outside a trace. """
+
+    def __init__(self, tracer: "Tracer"):
+        super().__init__(tracer=tracer, name="noop", trace_id="", start_time_ns=0)
+
+    def set_attribute(self, key: str, value):
+        pass
+
+    def add_event(self, name: str, attributes: Optional[dict] = None):
+        pass
+
+    def set_error(self, message: str):
+        pass
+
+    def end(self, end_time_ns: Optional[int] = None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class OTLPHttpExporter(object):
+    """ Export traces as OTLP/JSON over HTTP to a collector (e.g. http://localhost:4318/v1/traces). """
+
+    def __init__(self, endpoint: str, timeout_seconds: float = 2.0):
+        self.endpoint = endpoint
+        self.timeout_seconds = timeout_seconds
+
+    def export(self, payload: dict):
+        import urllib.request
+
+        request = urllib.request.Request(self.endpoint,
+                                         data=json.dumps(payload).encode("utf-8"),
+                                         headers={"Content-Type": "application/json"},
+                                         method="POST")
+        with urllib.request.urlopen(request, timeout=self.timeout_seconds) as response:
+            response.read()
+
+
+class FileExporter(object):
+    """
+    Append traces as OTLP/JSON to a file, one export request per line. This is the same format written by the
+    OpenTelemetry collector 'file' exporter, so the file can be replayed into a collector or inspected directly.
+    It is also used as a local stand-in for a collector.
+    """
+
+    def __init__(self, trace_file: str):
+        self.trace_file = trace_file
+
+    def export(self, payload: dict):
+        p = Path(self.trace_file)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        with p.open(mode='a', encoding="utf-8") as f:
+            f.write(json.dumps(payload, separators=(",", ":")))
+            f.write("\n")
+
+    def read(self) -> list:
+        """ Return the spans written to the trace file, in OTLP/JSON form. """
+        spans = []
+        try:
+            with Path(self.trace_file).open(mode='r', encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    for resource_spans in json.loads(line).get("resourceSpans", []):
+                        for scope_spans in resource_spans.get("scopeSpans", []):
+                            spans.extend(scope_spans.get("spans", []))
+        except FileNotFoundError:
+            pass
+        return spans
+
+
+class Tracer(object):
+    """
+    Collect the spans of each operation, and export the whole trace once its root span ends. Finished traces are
+    queued and exported on a background thread, so a slow collector never delays the handling of a vMotion.
+
+    Without an exporter the tracer is disabled and only hands out no-op spans.
+    """
+
+    SCOPE_NAME = "vmnotification"
+
+    def __init__(self, exporter=None, resource_attributes: Optional[dict] = None):
+        self.exporter = exporter
+        self.resource_attributes = {"service.name": "vmnotification"}
+        if resource_attributes:
+            self.resource_attributes.update(resource_attributes)
+        self.__noop = _NoopSpan(self)
+        self.__pending = {}
+        self.__local = threading.local()
+        self.__lock = threading.Lock()
+        self.__queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self.__thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def _stack(self) -> list:
+        stack = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = self.__local.stack = []
+        return stack
+
+    @property
+    def current(self) -> Optional[Span]:
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def push(self, span: Span):
+        self._stack().append(span)
+
+    def pop(self, span: Span):
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+
+    def start_trace(self, name: str, attributes: Optional[dict] = None, start_time_ns: Optional[int] = None,
+                    trace_id: Optional[str] = None) -> Span:
+        """ Start the root span of a new trace, or of an existing 'trace_id', e.g. continued after an upgrade. """
+        if not self.enabled:
+            return self.__noop
+        return Span(tracer=self,
+                    name=name,
+                    trace_id=trace_id or os.urandom(16).hex(),
+                    attributes=attributes,
+                    start_time_ns=start_time_ns)
+
+    def start_span(self,
+                   name: str,
+                   parent: Optional[Span] = None,
+                   kind: int = SPAN_KIND_INTERNAL,
+                   attributes: Optional[dict] = None,
+                   start_time_ns: Optional[int] = None) -> Span:
+        """
+        Start a child span of 'parent', or of the innermost active span. Outside a trace, a no-op span is
+        returned so the periodic polling does not produce a trace for every call.
+        """
+        parent = parent if parent is not None else self.current
+        if not self.enabled or parent is None or isinstance(parent, _NoopSpan):
+            return self.__noop
+        return Span(tracer=self,
+                    name=name,
+                    trace_id=parent.trace_id,
+                    parent=parent,
+                    kind=kind,
+                    attributes=attributes,
+                    start_time_ns=start_time_ns)
+
+    def span_ended(self, span: Span):
+        with self.__lock:
+            self.__pending.setdefault(span.trace_id, []).append(span)
+            if not span.is_root:
+                return
+            spans = self.__pending.pop(span.trace_id)
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self._export_loop, name="tracing", daemon=True)
+                self.__thread.start()
+        try:
+            self.__queue.put_nowait(spans)
+        except queue.Full:
+            logger.warning(f"span_ended: Export queue full, trace '{span.trace_id}' dropped")
+
+    def _export_loop(self):
+        while True:
+            item = self.__queue.get()
+            if isinstance(item, threading.Event):
+                item.set()
+            else:
+                self.export(item)
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """ Wait for the queued traces to be exported, e.g. before the process exits. Return False on timeout. """
+        if self.__thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        flushed = threading.Event()
+        try:
+            self.__queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return False
+        return flushed.wait(max(0.0, deadline - time.monotonic()))
+
+    def export(self, spans: list):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes(self.resource_attributes)},
+                "scopeSpans": [{
+                    "scope": {"name": self.SCOPE_NAME},
+                    "spans": [span.otlp() for span in spans],
+                }],
+            }]
+        }
+        try:
+            self.exporter.export(payload)
+            logger.debug(f"export: Exported {len(spans)} spans for trace '{spans[-1].trace_id}'")
+        except Exception as e:
+            # Tracing must never interfere with the handling of a vMotion
+            logger.warning(f"export: Could not export trace: {e}")
+
+
+def create_tracer(exporter: str,
+                  otlp_endpoint: str,
+                  otlp_timeout_seconds: float,
+                  trace_file: str,
+                  resource_attributes: Optional[dict] = None) -> Tracer:
+    match exporter.lower():
+        case "otlp":
+            return Tracer(exporter=OTLPHttpExporter(endpoint=otlp_endpoint, timeout_seconds=otlp_timeout_seconds),
+                          resource_attributes=resource_attributes)
+        case "file":
+            return Tracer(exporter=FileExporter(trace_file=trace_file),
+                          resource_attributes=resource_attributes)
+        case _:
+            return Tracer(resource_attributes=resource_attributes)
@@ -0,0 +1,193 @@
+import json
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+TRANSCRIPT_VERSION = 1
+RPC_PREFIX = "vm-operation-notification."
+TOKEN_PLACEHOLDER = "<token>"
+_TOKEN_RE = re.compile(r'("uniqueToken":\s*")[^"]*(")')
+
+
+class Clock(object):
+    """ Time source of the service, replaced by a VirtualClock to replay a transcript. """
+
+    def time(self) -> float:
+        return time.time()
+
+    def time_ns(self) -> int:
+        return time.time_ns()
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def sleep(self, seconds: float):
+        time.sleep(seconds)
+
+
+class VirtualClock(Clock):
+    """
+    Clock that only advances when slept or advanced explicitly, so that a replay is deterministic. With a 'speed'
+    greater than 0, every virtual second also takes 1/speed real second, e.g. to follow a replay; otherwise the
+    replay runs as fast as possible.
+    """
+
+    def __init__(self, start_time: float, speed: float = 0):
+        self.start_time = start_time
+        self.speed = speed
+        self.__elapsed = 0.0
+
+    def time(self) -> float:
+        return self.start_time + self.__elapsed
+
+    def time_ns(self) -> int:
+        return int(self.time() * 1e9)
+
+    def monotonic(self) -> float:
+        return self.__elapsed
+
+    def sleep(self, seconds: float):
+        self.advance(seconds)
+
+    def advance(self, seconds: float):
+        if seconds <= 0:
+            return
+        self.__elapsed += seconds
+        if self.speed > 0:
+            time.sleep(seconds / self.speed)
+
+
+def obfuscate_token(text: str) -> str:
+    return _TOKEN_RE.sub(rf"\g<1>{TOKEN_PLACEHOLDER}\g<2>", text)
+
+
+def is_idle_reply(reply_text: str) -> bool:
+    """ Whether a 'check-for-event' reply is a successful poll without an event. """
+    try:
+        reply = json.loads(reply_text)
+    except ValueError:
+        return False
+    return isinstance(reply, dict) and reply.get("result") is True and reply.get("eventType") is None
+
+
+class TranscriptRecorder(object):
+    """
+    Record the RPCs of the service and the duration of its hooks into a transcript file (JSON lines), to replay
+    them later with vmnotification_replay. Every process start appends a header line, followed by one line per RPC:
+
+        {"t": 12.031, "d": 0.048, "rpc": "check-for-event", "reply": "{\"result\": true, \"eventType\": ...}"}
+        {"t": 12.084, "d": 9.514, "hook": "pre_vmotion", "exit_code": 0}
+
+    't' is the monotonic time since the header, and 'd' the duration. The registration token is never recorded.
+    Consecutive polls without an event are written as a single line once the run ends, with their count 'n', the
+    time of the last one 'until' and their mean period 'p', so that an idle service adds a line per event rather
+    than per poll.
+    """
+
+    def __init__(self, transcript_file: str, clock: Optional[Clock] = None):
+        self.transcript_file = transcript_file
+        self.clock = clock if clock is not None else Clock()
+        self.__file = None
+        self.__start = None
+        self.__idle = None
+        self.__lock = threading.Lock()
+
+    def open(self, **header):
+        p = Path(self.transcript_file)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        self.__file = p.open(mode='a', encoding="utf-8")
+        self.__start = self.clock.monotonic()
+        self._write({"transcript": TRANSCRIPT_VERSION, "start_time": self.clock.time(), **header})
+
+    def close(self):
+        with self.__lock:
+            if self.__file is None:
+                return
+            self._flush_idle()
+            self.__file.close()
+            self.__file = None
+
+    def _write(self, entry: dict):
+        self.__file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.__file.flush()
+
+    def _flush_idle(self):
+        if self.__idle is None:
+            return
+        idle, self.__idle = self.__idle, None
+        if idle["n"] > 1:
+            idle["p"] = round((idle["until"] - idle["t"]) / (idle["n"] - 1), 4)
+        else:
+            del idle["until"]
+        idle["d"] = round(idle.pop("d_sum") / idle["n"], 4)
+        self._write(idle)
+
+    def elapsed(self, monotonic: float) -> float:
+        return round(monotonic - self.__start, 4)
+
+    def record_rpc(self, rpc_name: str, argv: list, start: float, duration: float, reply: bytes):
+        """ Record an RPC, from its command line, its start (monotonic) and duration, and the raw reply. """
+        with self.__lock:
+            if self.__file is None:
+                return
+            try:
+                t = self.elapsed(start)
+                rpc = rpc_name.removeprefix(RPC_PREFIX)
+                reply_text = obfuscate_token(reply.decode("utf-8", errors="replace").strip())
+
+                if rpc == "check-for-event" and is_idle_reply(reply_text):
+                    if self.__idle is not None and self.__idle["reply"] != reply_text:
+                        self._flush_idle()
+                    if self.__idle is None:
+                        self.__idle = {"t": t, "rpc": rpc, "reply": reply_text, "n": 0, "until": t, "d_sum": 0.0}
+                    self.__idle["n"] += 1
+                    self.__idle["until"] = t
+                    self.__idle["d_sum"] += duration
+                    return
+
+                self._flush_idle()
+                entry = {"t": t, "d": round(duration, 4), "rpc": rpc, "reply": reply_text}
+                _, _, param = argv[-1].partition(" ")
+                params = json.loads(param) if param.strip() else {}
+                params.pop("uniqueToken", None)
+                if params:
+                    entry["params"] = params
+                self._write(entry)
+            except (OSError, ValueError) as e:
+                # Recording must never interfere with the handling of a vMotion
+                logger.warning(f"record_rpc: Could not record '{rpc_name}': {e}")
+
+    def record_hook(self, name: str, start: float, duration: float, exit_code: int, rehearsal: bool = False):
+        with self.__lock:
+            if self.__file is None:
+                return
+            try:
+                self._flush_idle()
+                entry = {"t": self.elapsed(start), "d": round(duration, 4), "hook": name, "exit_code": exit_code}
+                if rehearsal:
+                    entry["rehearsal"] = True
+                self._write(entry)
+            except OSError as e:
+                logger.warning(f"record_hook: Could not record '{name}': {e}")
+
+
+def load_transcript(transcript_file: str) -> list:
+    """ Return the sessions of a transcript file, as (header, entries) tuples, one per process start. """
+    sessions = []
+    with open(transcript_file, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "transcript" in entry:
+                if entry["transcript"] != TRANSCRIPT_VERSION:
+                    raise ValueError(f"Unsupported transcript version {entry['transcript']}")
+                sessions.append((entry, []))
+            elif sessions:
+                sessions[-1][1].append(entry)
+    return sessions
@@ -0,0 +1,364 @@
+import json
+import logging
+import os
+import shlex
+import signal
+import threading
+from pathlib import Path
+from subprocess import Popen, PIPE, DEVNULL, STDOUT, TimeoutExpired
+from time import monotonic, time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+logger_vmotion = logging.getLogger('vmotion')
+
+WARMUP_TASK_TYPES = ("command", "files", "hotkeys")
+READ_CHUNK_BYTES = 1024 * 1024
+STOP_CHECK_SECONDS = 1.0
+READY_CMD_TIMEOUT_SECONDS = 60
+
+
+def validate_warmup_task(task: dict):
+    """ Validate a warm-up task, as read from a [Warmup:<name>] section of the configuration file. """
+    if not isinstance(task, dict):
+        raise ValueError(f"warmup task must be a dictionary (input: '{task}')")
+    name = task.get("name")
+    if not isinstance(name, str) or len(name) < 1:
+        raise ValueError(f"warmup task name must be a string with at least 1 character (input: '{name}')")
+
+    match task.get("type"):
+        case "command":
+            if not task.get("command"):
+                raise ValueError(f"warmup task '{name}': 'command' is required")
+        case "files":
+            if not isinstance(task.get("paths"), list) or not task.get("paths"):
+                raise ValueError(f"warmup task '{name}': 'paths' must list at least one file or pattern")
+        case "hotkeys":
+            if not task.get("command") or not task.get("keys_file"):
+                raise ValueError(f"warmup task '{name}': 'command' and 'keys_file' are required")
+            template = task.get("template", "{key}")
+            if "{key}" not in template:
+                raise ValueError(f"warmup task '{name}': 'template' must contain '{{key}}' (input: '{template}')")
+        case _:
+            raise ValueError(f"warmup task '{name}': type must be one of {WARMUP_TASK_TYPES} "
+                             f"(input: '{task.get('type')}')")
+
+
+class Warmup(object):
+    """
+    Warm the application up after a vMotion, once the post-vmotion command restarted it. Right after a migration
+    the application serves from empty caches, so priming tasks run concurrently on a bounded pool of workers:
+
+    - command: run a command, e.g. to pre-open the connection pools of the application.
+    - files: read files matching glob patterns into the page cache.
+    - hotkeys: replay a recorded list of hot keys, written one per line on the stdin of a client command. The
+      list is split among the workers.
+
+    While the tasks run, a probe command is timed at regular intervals to record the recovered-latency curve.
+    Readiness is signalled (ready command) once the tasks completed and the probe latency is under its target,
+    or when the deadline expires.
+
+    The service runs the warm-up on a background thread (start), so that it keeps polling for the next vMotion,
+    and cancels it if one starts.
+    """
+
+    def __init__(self,
+                 tasks: list,
+                 max_workers: int = 4,
+                 deadline_seconds: float = 300,
+                 probe_cmd: Optional[str] = None,
+                 target_latency_ms: Optional[float] = None,
+                 probe_interval_seconds: float = 1,
+                 ready_cmd: Optional[str] = None,
+                 curve_file: Optional[str] = None):
+        self.tasks = tasks
+        self.max_workers = max_workers
+        self.deadline_seconds = deadline_seconds
+        self.probe_cmd = probe_cmd
+        self.probe_cmd_split = shlex.split(probe_cmd) if probe_cmd else None
+        self.target_latency_ms = target_latency_ms
+        self.probe_interval_seconds = probe_interval_seconds
+        self.ready_cmd = ready_cmd
+        self.curve_file = curve_file
+        self.__stop = threading.Event()
+        self.__cancel = threading.Event()
+        self.__done = threading.Event()
+        self.__processes = set()
+        # Reentrant, stop() also kills the processes from the signal handler of the service
+        self.__lock = threading.RLock()
+        self.__thread = None
+        self.__result = None
+
+    def _popen(self, cmd_split: list, stdin=DEVNULL, stdout=DEVNULL) -> Popen:
+        # In its own process group, to kill the children of the command as well at the deadline
+        process = Popen(cmd_split, stdin=stdin, stdout=stdout, stderr=STDOUT, start_new_session=True)
+        with self.__lock:
+            self.__processes.add(process)
+        return process
+
+    def _wait(self, process: Popen, timeout: Optional[float] = None) -> Optional[int]:
+        """ Wait for a process, killing its process group once 'timeout' expired, then return None. """
+        try:
+            return process.wait(timeout=timeout)
+        except TimeoutExpired:
+            self._kill(process)
+            process.wait()
+            return None
+        finally:
+            with self.__lock:
+                self.__processes.discard(process)
+
+    @staticmethod
+    def _kill(process: Popen):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _kill_processes(self):
+        with self.__lock:
+            for process in self.__processes:
+                self._kill(process)
+
+    def _run_command(self, cmd: str):
+        returncode = self._wait(self._popen(shlex.split(cmd)))
+        if returncode != 0 and not self.__done.is_set():
+            raise RuntimeError(f"'{cmd}' exited with {returncode}")
+
+    def _read_file(self, path: str) -> int:
+        read = 0
+        buffer = bytearray(READ_CHUNK_BYTES)
+        with open(path, mode='rb', buffering=0) as f:
+            while not self.__done.is_set():
+                n = f.readinto(buffer)
+                if not n:
+                    break
+                read += n
+        return read
+
+    def _replay_keys(self, cmd: str, template: str, keys: list):
+        process = self._popen(shlex.split(cmd), stdin=PIPE)
+        try:
+            for key in keys:
+                if self.__done.is_set():
+                    break
+                process.stdin.write(template.format(key=key).encode("utf-8") + b"\n")
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self._wait(process)
+        if returncode != 0 and not self.__done.is_set():
+            raise RuntimeError(f"'{cmd}' exited with {returncode}")
+
+    def jobs(self) -> list:
+        """ Split the tasks in (name, callable) jobs for the workers. """
+        import glob
+
+        jobs = []
+        for task in self.tasks:
+            name = task["name"]
+            match task["type"]:
+                case "command":
+                    jobs.append((name, lambda cmd=task["command"]: self._run_command(cmd)))
+                case "files":
+                    for pattern in task["paths"]:
+                        for path in sorted(glob.glob(pattern, recursive=True)):
+                            if Path(path).is_file():
+                                jobs.append((f"{name}:{path}", lambda p=path: self._read_file(p)))
+                case "hotkeys":
+                    try:
+                        with open(task["keys_file"], encoding="utf-8") as f:
+                            keys = [line.strip() for line in f if line.strip()]
+                    except OSError as e:
+                        logger.warning(f"jobs: Warm-up task '{name}' skipped: {e}")
+                        continue
+                    chunks = max(1, min(self.max_workers, len(keys)))
+                    for i in range(chunks):
+                        jobs.append((f"{name}:{i}", lambda c=task["command"], t=task.get("template", "{key}"),
+                                     k=keys[i::chunks]: self._replay_keys(c, t, k)))
+        return jobs
+
+    def probe(self, timeout: Optional[float] = None) -> tuple:
+        """
+        Time the probe command, return its latency in milliseconds and whether it succeeded. A probe still running
+        after 'timeout' seconds is killed, and failed.
+        """
+        start = monotonic()
+        try:
+            process = self._popen(self.probe_cmd_split)
+        except OSError as e:
+            logger.error(f"probe: Could not run the probe command '{self.probe_cmd}': {e}")
+            return (monotonic() - start) * 1000, False
+        returncode = self._wait(process, timeout=timeout)
+        if returncode is None:
+            logger.warning(f"probe: Probe command '{self.probe_cmd}' killed after {timeout:.3f} seconds")
+        return (monotonic() - start) * 1000, returncode == 0
+
+    def run(self, span=None, operation_id=None) -> dict:
+        """ Run the warm-up, signal readiness, and return its result with the recovered-latency curve. """
+        from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+        self.__done = threading.Event()
+        start = monotonic()
+        deadline = start + self.deadline_seconds
+        jobs = self.jobs()
+        failed = []
+        curve = []
+        reason = "deadline"
+        logger_vmotion.debug(f"warm-up starting: {len(jobs)} job(s) on {self.max_workers} worker(s), "
+                             f"deadline {self.deadline_seconds} seconds.")
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="warmup")
+        try:
+            futures = {executor.submit(job): name for name, job in jobs}
+            pending = set(futures)
+            next_probe = start
+            while True:
+                now = monotonic()
+                if self.probe_cmd_split and next_probe <= now < deadline and not self.__cancel.is_set():
+                    # A slow probe neither delays the next one nor runs past the deadline
+                    latency_ms, ok = self.probe(timeout=min(self.probe_interval_seconds, deadline - now))
+                    elapsed = monotonic() - start
+                    curve.append((round(elapsed, 3), round(latency_ms, 3), ok))
+                    if span is not None:
+                        span.add_event("probe", {"warmup.elapsed_seconds": elapsed,
+                                                 "warmup.latency_ms": latency_ms,
+                                                 "warmup.probe_ok": ok})
+                    logger_vmotion.debug(f"warm-up probe at {elapsed:.3f}s: {latency_ms:.1f} ms "
+                                         f"({'ok' if ok else 'failed'}).")
+                    next_probe = now + self.probe_interval_seconds
+
+                if not pending and self._target_reached(curve):
+                    reason = "target"
+                    break
+                if self.__stop.is_set():
+                    reason = "stop"
+                    break
+                if self.__cancel.is_set():
+                    reason = "cancelled"
+                    break
+                if monotonic() >= deadline:
+                    break
+
+                # Wake up at least every STOP_CHECK_SECONDS to honour a stop request
+                wake_up = min(deadline, next_probe) if self.probe_cmd_split else deadline
+                timeout = max(0.0, min(wake_up - monotonic(), STOP_CHECK_SECONDS))
+                if pending:
+                    done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is not None:
+                            failed.append(futures[future])
+                            logger.warning(f"run: Warm-up job '{futures[future]}' failed: {future.exception()}")
+                else:
+                    self.__cancel.wait(timeout)
+        finally:
+            # Stop the jobs still running at the deadline
+            self.__done.set()
+            self._kill_processes()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        duration = monotonic() - start
+        result = {
+            "operation_id": operation_id,
+            "time": time(),
+            "ready_reason": reason,
+            "duration_seconds": round(duration, 3),
+            "jobs": len(jobs),
+            "failed": failed,
+            "curve": curve,
+        }
+        logger_vmotion.debug(f"warm-up complete in {duration:.3f} seconds ({reason}), "
+                             f"{len(failed)} of {len(jobs)} job(s) failed.")
+        if span is not None:
+            span.set_attribute("warmup.ready_reason", reason)
+            span.set_attribute("warmup.jobs", len(jobs))
+            span.set_attribute("warmup.failed_jobs", len(failed))
+
+        # Cut short, the application is being stopped or drained again
+        if reason in ("target", "deadline"):
+            self.signal_ready()
+        self.save_curve(result)
+        return result
+
+    def start(self, span=None, operation_id=None):
+        """ Run the warm-up on a background thread, its result is returned by result() once complete. """
+        self.__cancel = threading.Event()
+        self.__result = None
+        self.__thread = threading.Thread(target=self._run_in_thread, args=(span, operation_id), name="warmup",
+                                         daemon=True)
+        self.__thread.start()
+
+    def _run_in_thread(self, span, operation_id):
+        try:
+            self.__result = self.run(span=span, operation_id=operation_id)
+        except Exception as e:
+            logger.error(f"run: Warm-up failed: {e}")
+            self.__result = {"operation_id": operation_id, "time": time(), "ready_reason": "error", "error": str(e)}
+
+    @property
+    def running(self) -> bool:
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def result(self, timeout: float = 0) -> Optional[dict]:
+        """ Return the result of the warm-up started by start(), or None while it still runs after 'timeout'. """
+        if self.__thread is None:
+            return None
+        self.__thread.join(timeout)
+        if self.__thread.is_alive():
+            return None
+        self.__thread = None
+        return self.__result
+
+    def cancel(self):
+        """ Cut the running warm-up short without signalling readiness, e.g. when the next vMotion starts. """
+        self.__cancel.set()
+        self._kill_processes()
+
+    def _target_reached(self, curve: list) -> bool:
+        if not self.probe_cmd_split:
+            return True
+        if not curve or not curve[-1][2]:
+            return False
+        return self.target_latency_ms is None or curve[-1][1] <= self.target_latency_ms
+
+    def stop(self):
+        """ Cut the running warm-up short and skip the next ones, when the service stops. """
+        self.__stop.set()
+        self.cancel()
+
+    def signal_ready(self):
+        from vmnotification_systemd import notify
+
+        notify("STATUS=Application warmed up after vMotion")
+        if not self.ready_cmd:
+            return
+        logger_vmotion.debug(f"ready command starting: '{self.ready_cmd}'.")
+        try:
+            process = self._popen(shlex.split(self.ready_cmd), stdout=PIPE)
+        except OSError as e:
+            logger.error(f"signal_ready: Could not run the ready command '{self.ready_cmd}', skipped: {e}")
+            return
+        try:
+            stdout, _ = process.communicate(timeout=READY_CMD_TIMEOUT_SECONDS)
+        except TimeoutExpired:
+            self._kill(process)
+            stdout, _ = process.communicate()
+            logger.error(f"signal_ready: Ready command '{self.ready_cmd}' killed after "
+                         f"{READY_CMD_TIMEOUT_SECONDS} seconds")
+        finally:
+            with self.__lock:
+                self.__processes.discard(process)
+        for line in stdout.splitlines():
+            logger.debug(f"signal_ready: '{line}'")
+        logger_vmotion.debug(f"ready command complete.")
+
+    def save_curve(self, result: dict):
+        if not self.curve_file:
+            return
+        try:
+            p = Path(self.curve_file)
+            p.parent.mkdir(parents=True, exist_ok=True)
+            with p.open(mode='a', encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+        except OSError as e:
+            logger.error(f"save_curve: Could not save the warm-up curve to '{self.curve_file}': {e}")